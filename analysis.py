@@ -5,22 +5,52 @@ from simulation import Simulation
 from statistics import mean, median , stdev
 import pickle
 
-def figures_2_and_3():
+def evaluate_point(params: Parameters, games: int = 2000, 
+        method: str = "slsqp"):
+    """
+    Optimizes the game for `params` and simulates `games` games with the
+    equilibrium strategies, returning statistics of the transmitter's 
+    rewards and successes.
+    """
+    model, f, y = optimize_game(params, method = method)
 
-    fh_ra_rates = Parameters().rates
-    fh_only_6_rates = [6]
-    fh_only_24_rates = [24]
-    fh_only_54_rates = [54]
+    simulation = Simulation(f, y, model, precision = ROUND_PRECISION - 2)
+    tx_rewards = []
+    tx_successes = []
 
-    variants = [fh_ra_rates, fh_only_54_rates, fh_only_24_rates, 
-        fh_only_6_rates]
+    for _ in range(games):
+        reward, success = simulation.run()
+        tx_rewards.append(reward)
+        tx_successes.append(success)
+        
+    return {
+        "rewards": {
+            "mean": mean(tx_rewards),
+            "median": median(tx_rewards),
+            "stdev": stdev(tx_rewards)
+        }, 
+        "successes": {
+            "mean": mean(tx_successes),
+            "median": median(tx_successes),
+            "stdev": stdev(tx_successes)
+        }
+    }
 
-    names = [
+def get_figure_parameters():
+    """
+    Returns the names of the variants in figures 2 and 3 of the paper, and 
+    the rates of each.
+    """
+    return [
         "Joint FH and RA",
         "FH only, Rate = 54 Mbps",
         "FH only, Rate = 24 Mbps",
         "FH only, Rate = 6 Mbps"
-    ]
+    ], [Parameters().rates, [54], [24], [6]]
+
+def figures_2_and_3():
+
+    names, variants = get_figure_parameters()
 
     results = {}
 
@@ -32,30 +62,7 @@ def figures_2_and_3():
             print(f"Optimizing:     {names[i]} for k = {k}")
 
             params = Parameters(rates = rates, k = k, m = len(rates) - 1)
-            model, f, y = optimize_game(params)
-
-            simulation = Simulation(f, y, model, 
-                precision = ROUND_PRECISION - 2)
-            tx_rewards = []
-            tx_successes = []
-
-            for _ in range(2000):
-                reward, success = simulation.run()
-                tx_rewards.append(reward)
-                tx_successes.append(success)
-                
-            results[names[i]][str(k)] = {
-                "rewards": {
-                    "mean": mean(tx_rewards),
-                    "median": median(tx_rewards),
-                    "stdev": stdev(tx_rewards)
-                }, 
-                "successes": {
-                    "mean": mean(tx_successes),
-                    "median": median(tx_successes),
-                    "stdev": stdev(tx_successes)
-                }
-            }
+            results[names[i]][str(k)] = evaluate_point(params)
 
             print(f"Optimization of {names[i]} for k = {k} complete.")
             
@@ -0,0 +1,185 @@
+import argparse, random, time
+
+from model import Model
+from parameters import Parameters
+
+class Decision:
+    """
+    What the transmitter does in the next turn: the action it chose, whether
+    it hops, and the channel and rate index it transmits on.
+    TransmitterController updates a single Decision in place instead of
+    creating a new one every turn.
+    """
+    __slots__ = ["hop", "channel", "rate_index", "action"]
+
+    def __init__(self):
+        self.hop = False
+        self.channel = 0
+        self.rate_index = 0
+        self.action = None
+
+    def __repr__(self):
+        return (f"Decision(hop = {self.hop}, channel = {self.channel}, " +
+            f"rate_index = {self.rate_index}, action = {self.action})")
+
+class TransmitterController:
+    def __init__(self, f, model: Model, pn_sequence: 'list[int]' = None,
+            seed: int = None):
+        """
+        Runs the transmit strategy `f` (a dict of action probabilities for
+        each state, or a QTable) outside of a Simulation, for use in a
+        real-time loop. After each turn, call `decide` with whether the
+        message was acknowledged to get the next Decision.
+
+        The success-count state follows the same rules as
+        Simulation.play_turn. The transmitter hops along `pn_sequence`
+        (drawn at random, with params.t channels, if not given), which
+        repeats when it runs out, and the first turn behaves like staying
+        on its first channel at the highest rate.
+
+        Each state's action distribution is compiled into an alias table,
+        so a decision takes O(1) time and a single random number, whatever
+        the number of actions. A QTable is compiled as it is when the
+        controller is created (see `compile`).
+        """
+        self.model = model
+        self.params = model.params
+        # One generator for both, so that the decisions do not repeat the
+        # draws of the PN sequence
+        generator = random.Random(seed)
+        self.random = generator.random
+
+        if pn_sequence is None:
+            pn_sequence = [generator.randrange(self.params.k)
+                for _ in range(self.params.t)]
+        self.pn_sequence = list(pn_sequence)
+
+        # States are numbered by their success count, with "j" as 0
+        self.last_state = len(model.state_space) - 1
+        self.action_count = len(model.action_space)
+        self.actions = list(model.action_space)
+        self.action_hops = [action[0] == "h" for action in model.action_space]
+        self.action_rates = [int(action[1:]) for action
+            in model.action_space]
+
+        self.decision = Decision()
+        self.compile(f)
+        self.reset()
+
+    def compile(self, f):
+        """
+        Builds the alias tables for the transmit strategy `f` (with Vose's
+        alias method).
+        """
+        self.alias_probabilities = []
+        self.aliases = []
+
+        for state in self.model.state_space:
+            scaled = [f[state][action] * self.action_count
+                for action in self.model.action_space]
+            probabilities = [1.0] * self.action_count
+            aliases = list(range(self.action_count))
+
+            small = [i for i, p in enumerate(scaled) if p < 1]
+            large = [i for i, p in enumerate(scaled) if p >= 1]
+            while small and large:
+                less = small.pop()
+                more = large.pop()
+                probabilities[less] = scaled[less]
+                aliases[less] = more
+                scaled[more] += scaled[less] - 1
+                (small if scaled[more] < 1 else large).append(more)
+
+            self.alias_probabilities.append(probabilities)
+            self.aliases.append(aliases)
+
+    def reset(self):
+        """
+        Starts over from the initial state ("j") and the start of the PN
+        sequence.
+        """
+        self.state = 0
+        self.pn_index = 0
+
+        decision = self.decision
+        decision.hop = False
+        decision.channel = self.pn_sequence[0]
+        decision.rate_index = len(self.params.rates) - 1
+        decision.action = None
+
+    def get_state(self):
+        """
+        Returns the current state, as a state of the model.
+        """
+        return self.model.state_space[self.state]
+
+    def decide(self, ack: bool):
+        """
+        Updates the state with the outcome of the last message (True if it
+        was acknowledged, False if it was jammed), and returns the Decision
+        for the next turn. The Decision is the same object every time.
+        """
+        state = self.state
+        if not ack:
+            state = 0
+        elif state < self.last_state:
+            state += 1
+
+        # Draw an action from the alias table of the state
+        u = self.random() * self.action_count
+        action = int(u)
+        if u - action >= self.alias_probabilities[state][action]:
+            action = self.aliases[state][action]
+
+        decision = self.decision
+        decision.action = self.actions[action]
+        decision.rate_index = self.action_rates[action]
+        decision.hop = self.action_hops[action]
+
+        if decision.hop:
+            state = 0
+            self.pn_index += 1
+            if self.pn_index == len(self.pn_sequence):
+                self.pn_index = 0
+            decision.channel = self.pn_sequence[self.pn_index]
+
+        self.state = state
+        return decision
+
+def benchmark_controller(controller: TransmitterController,
+        decisions: int = 1000000, ack_rate: float = 0.9):
+    """
+    Returns the number of decisions per second that `controller` makes, with
+    each message acknowledged with probability `ack_rate`. The outcomes are
+    drawn before timing starts.
+    """
+    generator = random.Random(0)
+    outcomes = [generator.random() < ack_rate for _ in range(4096)]
+    outcomes = (outcomes * (decisions // len(outcomes) + 1))[:decisions]
+    decide = controller.decide
+
+    start = time.perf_counter()
+    for ack in outcomes:
+        decide(ack)
+    elapsed = time.perf_counter() - start
+
+    controller.reset()
+    return decisions / elapsed
+
+def main():
+    from optimize import create_random_strategies
+
+    parser = argparse.ArgumentParser(description = "Benchmark the " +
+        "transmitter controller.")
+    parser.add_argument("--k", type = int, default = 10)
+    parser.add_argument("--decisions", type = int, default = 1000000)
+    args = parser.parse_args()
+
+    model = Model(Parameters(k = args.k))
+    f, _ = create_random_strategies(model)
+    controller = TransmitterController(f, model, seed = 0)
+    rate = benchmark_controller(controller, args.decisions)
+    print(f"{round(rate):,} decisions per second")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import numpy as np
+from multiprocessing import Pool
+
+from model import Model
+from parameters import Parameters
+
+class Jammer:
+    """
+    The behaviour of the jammers in a MultiLinkSimulation. Each instance
+    controls all of the simulation's jammers at once (one per group of
+    links), holding their state in arrays indexed by jammer. By default,
+    each jammer draws its power from its jammer strategy y every turn.
+
+    Subclasses decide which channels are jammed (`get_channel_status`) and
+    how the jammers react to what they overhear (`update`).
+    """
+    def reset(self, simulation):
+        """
+        Starts a new game against `simulation`.
+        """
+        self.simulation = simulation
+        self.params = simulation.params
+        self.rng = simulation.rng
+        self.count = simulation.jammer_count
+        self.groups = simulation.groups
+
+    def draw_power_indices(self):
+        """
+        Returns the power index of each jammer for this turn.
+        """
+        simulation = self.simulation
+        return (self.rng.random((self.count, 1)) >= simulation.power_cdf
+            ).sum(axis = 1).clip(max = self.params.m)
+
+    def get_channel_status(self, channel: np.ndarray):
+        """
+        Given the channel of each link, returns whether the jammer of each
+        link is on that channel, and whether it is there as part of a
+        single-channel attack.
+        """
+        raise NotImplementedError
+
+    def update(self, channel: np.ndarray, overheard_links: np.ndarray,
+            overheard_ack: np.ndarray, overheard_nack: np.ndarray,
+            power_indices: np.ndarray):
+        """
+        Updates the jammers after a turn in which the links in
+        `overheard_links` were overheard on `channel`, and each jammer
+        overheard an ACK (`overheard_ack`), a NACK (`overheard_nack`) or
+        nothing.
+        """
+        pass
+
+class SweepJammer(Jammer):
+    """
+    The jammer of Simulation: sweeps a random permutation of the channels,
+    n at a time, starting a new permutation when it overhears a NACK, and 
+    stays on a single channel when it overhears an ACK there. 
+    
+    A jammer that faces a single link (without a shared jammer) follows
+    Simulation exactly: once it has overheard an ACK, its single-channel 
+    attack (whose SINR does not depend on the channel) applies to the link
+    even after the jammer resumes its sweep, until it overhears a NACK. A
+    shared jammer only makes the single-channel attack on links that are on
+    the channel it stays on, since it would otherwise attack every link on
+    every channel.
+    """
+    def reset(self, simulation):
+        super().reset(simulation)
+        k = self.params.k
+        self.block_count = simulation.block_count
+        self.shared = simulation.shared_jammer
+
+        # Keeping the position of each channel in the permutation means a
+        # channel is jammed when its position // n is the current block.
+        self.jam_sequence = np.zeros((self.count, k), dtype = int)
+        self.jam_positions = np.zeros((self.count, k), dtype = int)
+        self.current_jam_index = np.zeros(self.count, dtype = int)
+        self.jam_single_channel = np.zeros(self.count, dtype = bool)
+
+        # Whether each jammer stays on its single_jammed_channel this turn
+        # instead of sweeping
+        self.on_single_channel = np.zeros(self.count, dtype = bool)
+        self.single_jammed_channel = np.zeros(self.count, dtype = int)
+        self.reset_jam_sequences(np.arange(self.count))
+
+    def reset_jam_sequences(self, jammers: np.ndarray):
+        """
+        Restart the sweep of each jammer in `jammers` with a new random
+        permutation of the channels.
+        """
+        k = self.params.k
+        sequences = self.rng.permuted(np.tile(np.arange(k),
+            (len(jammers), 1)), axis = 1)
+
+        self.jam_sequence[jammers] = sequences
+        self.jam_positions[jammers[:, np.newaxis], sequences] = np.arange(k)
+        self.current_jam_index[jammers] = 0
+        self.jam_single_channel[jammers] = False
+        self.on_single_channel[jammers] = False
+
+    def get_channel_status(self, channel: np.ndarray):
+        groups = self.groups
+        swept = (self.jam_positions[groups, channel] // self.params.n
+            == self.current_jam_index[groups])
+        on_single_channel = self.on_single_channel[groups]
+        on_target = channel == self.single_jammed_channel[groups]
+        single_jam = (on_single_channel & on_target if self.shared
+            else self.jam_single_channel[groups])
+        return np.where(on_single_channel, on_target, swept), single_jam
+
+    def update(self, channel: np.ndarray, overheard_links: np.ndarray,
+            overheard_ack: np.ndarray, overheard_nack: np.ndarray,
+            power_indices: np.ndarray):
+        groups = self.groups
+
+        # Attack the channel of an overheard ACK
+        ack_links = overheard_links[overheard_ack[groups[overheard_links]]]
+        self.single_jammed_channel[groups[ack_links]] = channel[ack_links]
+        self.on_single_channel[:] = overheard_ack
+        self.jam_single_channel |= overheard_ack
+
+        sweeping = ~(overheard_ack | overheard_nack)
+        self.current_jam_index[sweeping] = ((self.current_jam_index[sweeping]
+            + 1) % self.block_count)
+
+        if overheard_nack.any():
+            self.reset_jam_sequences(np.flatnonzero(overheard_nack))
+
+class RandomJammer(Jammer):
+    """
+    Jams n channels chosen uniformly at random every turn, without reacting
+    to anything it overhears.
+    """
+    def get_channel_status(self, channel: np.ndarray):
+        params = self.params
+
+        # Only the channels that links are on matter. Of the d such channels
+        # of a jammer, the number that it jams is hypergeometric (n of k 
+        # channels are jammed), and which ones they are is uniform: the 
+        # channels with the lowest random ranks. This takes O(L log L) time,
+        # whatever k is.
+        pairs, inverse = np.unique(self.groups * params.k + channel, 
+            return_inverse = True)
+        pair_groups = pairs // params.k
+        counts = np.bincount(pair_groups, minlength = self.count)
+        jammed_counts = self.rng.hypergeometric(params.n, 
+            params.k - params.n, np.maximum(counts, 1))
+
+        order = np.lexsort((self.rng.random(len(pairs)), pair_groups))
+        ranks = np.empty(len(pairs), dtype = int)
+        ranks[order] = np.arange(len(pairs)) - (np.cumsum(counts) 
+            - counts)[pair_groups[order]]
+
+        jammed = (ranks < jammed_counts[pair_groups])[inverse.ravel()]
+        return jammed, np.zeros_like(jammed)
+
+class ReactiveJammer(SweepJammer):
+    """
+    Sweeps like SweepJammer, but attacks the channel of any transmission
+    that it overhears (ACK or NACK) for as long as it keeps overhearing
+    transmissions there, and then resumes its sweep where it left off.
+    """
+    def get_channel_status(self, channel: np.ndarray):
+        groups = self.groups
+        attacking = self.jam_single_channel[groups]
+        on_target = channel == self.single_jammed_channel[groups]
+        swept = (self.jam_positions[groups, channel] // self.params.n
+            == self.current_jam_index[groups])
+        return (np.where(attacking, on_target, swept),
+            attacking & on_target)
+
+    def update(self, channel: np.ndarray, overheard_links: np.ndarray,
+            overheard_ack: np.ndarray, overheard_nack: np.ndarray,
+            power_indices: np.ndarray):
+        groups = self.groups
+        overheard = overheard_ack | overheard_nack
+
+        self.single_jammed_channel[groups[overheard_links]] = \
+            channel[overheard_links]
+        self.jam_single_channel[:] = overheard
+
+        self.current_jam_index[~overheard] = ((self.current_jam_index[
+            ~overheard] + 1) % self.block_count)
+
+class PowerAdaptiveJammer(SweepJammer):
+    """
+    Sweeps like SweepJammer, but adapts its power: each power index drawn
+    from y is raised by an offset, which increases when the jammer
+    overhears an ACK (its power was too low) and decreases when it
+    overhears a NACK. While the jammer's average power so far exceeds
+    p_avg, it transmits at the lowest power instead.
+    """
+    def reset(self, simulation):
+        super().reset(simulation)
+        self.p_jam = np.array(self.params.p_jam)
+        self.power_offset = np.zeros(self.count, dtype = int)
+        self.energy = np.zeros(self.count)
+        self.turns = 0
+
+    def draw_power_indices(self):
+        power_indices = np.minimum(super().draw_power_indices()
+            + self.power_offset, self.params.m)
+        over_budget = self.energy > self.params.p_avg * self.turns
+        return np.where(over_budget, 0, power_indices)
+
+    def update(self, channel: np.ndarray, overheard_links: np.ndarray,
+            overheard_ack: np.ndarray, overheard_nack: np.ndarray,
+            power_indices: np.ndarray):
+        super().update(channel, overheard_links, overheard_ack,
+            overheard_nack, power_indices)
+
+        self.power_offset = np.clip(self.power_offset + overheard_ack
+            - overheard_nack, 0, self.params.m)
+        self.energy += self.p_jam[power_indices]
+        self.turns += 1
+
+JAMMER_MODELS = {
+    "random": RandomJammer,
+    "sweep": SweepJammer,
+    "reactive": ReactiveJammer,
+    "power-adaptive": PowerAdaptiveJammer
+}
+
+def run_tournament(fs: 'list[dict]', y: 'list[float]', model: Model,
+        jammers: dict = JAMMER_MODELS, games: int = 2000,
+        processes: int = None, precision: int = -1, seed: int = None):
+    """
+    Plays `games` games of each transmit strategy in `fs` against each
+    jammer model in `jammers` (a dict of names to Jammer classes), with the
+    jammers drawing their power from `y`.
+
+    All of the games against one jammer model are played at once, as the
+    independent links of a single MultiLinkSimulation. With `processes`, the
+    jammer models are simulated in parallel by that many processes.
+
+    Returns (1) the mean transmitter reward per unit time and (2) its
+    standard error, as arrays indexed by [transmit strategy, jammer model]
+    in the order of `fs` and `jammers`.
+    """
+    tasks = [(fs, y, model.params.convert_to_tuple(), jammer, games,
+        precision, None if seed is None else seed + i)
+        for i, jammer in enumerate(jammers.values())]
+
+    if processes is None or processes <= 1:
+        results = [play_jammer_model(task) for task in tasks]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(play_jammer_model, tasks)
+
+    rewards = np.array([mean for mean, _ in results]).T
+    errors = np.array([error for _, error in results]).T
+    return rewards, errors
+
+def play_jammer_model(task: tuple):
+    from multilink import MultiLinkSimulation
+
+    fs, y, params, jammer, games, precision, seed = task
+    model = Model(Parameters.get_from_tuple(params))
+
+    simulation = MultiLinkSimulation(fs, y, model, precision = precision,
+        shared_jammer = False, seed = seed, jammer = jammer(),
+        copies = games)
+    rewards, _ = simulation.run()
+
+    rewards = rewards.reshape(len(fs), games)
+    return (rewards.mean(axis = 1),
+        rewards.std(axis = 1, ddof = 1) / np.sqrt(games))
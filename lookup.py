@@ -0,0 +1,198 @@
+import itertools, json
+import numpy as np
+
+from model import Model, project_jammer_strategy
+from optimize import convert_list_to_strategies, convert_strategies_to_arrays, \
+    evaluate_values, find_equilibrium
+from parameters import Parameters, validate_param
+
+# The continuous axes of each grid, in the order that arrays are indexed
+GRID_AXES = ["p_avg", "c", "l"]
+
+def build_strategy_index(path: str, k_values: 'list[int]',
+        p_avg_values: 'list[float]', c_values: 'list[float]',
+        l_values: 'list[float]', base_params: Parameters = Parameters(),
+        method: str = "softmax", show_output: bool = False):
+    """
+    Solves the game at every point of the grid k_values x p_avg_values x
+    c_values x l_values (with the other parameters from `base_params`), and
+    saves the equilibrium strategies to a compressed .npz file at `path`,
+    for use with StrategyIndex.
+
+    For each k, the file holds f as an array indexed by [p_avg, c, l, x, a1],
+    y as an array indexed by [p_avg, c, l, a2] and the objective function 
+    at each grid point, along with the transitions and the components of 
+    the rewards (see Model.reward_components), which do not depend on the
+    grid, so that strategies can be evaluated anywhere on the grid. Each 
+    solve starts from the solution at the previous grid point.
+    """
+    grid = {"p_avg": np.sort(p_avg_values), "c": np.sort(c_values),
+        "l": np.sort(l_values)}
+    arrays = {f"{name}_values": values for name, values in grid.items()}
+    arrays["k_values"] = np.array(sorted(k_values))
+
+    for k in arrays["k_values"]:
+        f_grid = None
+        x0 = None
+
+        for index in itertools.product(*[range(len(grid[name]))
+                for name in GRID_AXES]):
+            params = Parameters.get_from_tuple(base_params.convert_to_tuple())
+            params.k = int(k)
+            for name, i in zip(GRID_AXES, index):
+                setattr(params, name, float(grid[name][i]))
+
+            if show_output:
+                print(f"Solving k = {k}, " + ", ".join(f"{name} = " +
+                    f"{getattr(params, name)}" for name in GRID_AXES))
+
+            model = Model(params)
+            x0 = find_equilibrium(model, False, x0 = x0, method = method)
+            f, y = convert_strategies_to_arrays(model,
+                *convert_list_to_strategies(model, x0))
+
+            if f_grid is None:
+                shape = tuple(len(grid[name]) for name in GRID_AXES)
+                f_grid = np.zeros(shape + f.shape)
+                y_grid = np.zeros(shape + y.shape)
+                value_grid = np.zeros(shape)
+                arrays[f"state_space_{k}"] = np.array(model.state_space)
+                arrays[f"reward_components_{k}"] = np.array(
+                    model.reward_components)
+                arrays[f"transitions_{k}"] = model.transition_tensor
+            f_grid[index] = f
+            y_grid[index] = y
+            value_grid[index] = np.sum(evaluate_values(model.reward_tensor,
+                model.transition_tensor, f, y))
+
+        arrays[f"f_{k}"] = f_grid
+        arrays[f"y_{k}"] = y_grid
+        arrays[f"values_{k}"] = value_grid
+
+    arrays["action_space"] = np.array(Model(base_params).action_space)
+    arrays["base_params"] = np.array(json.dumps(
+        base_params.convert_to_tuple()))
+    np.savez_compressed(path, **arrays)
+
+class StrategyIndex:
+    def __init__(self, path: str):
+        """
+        Loads an index of equilibrium strategies saved by
+        build_strategy_index, so that strategies can be looked up with
+        `query` without solving the game.
+        """
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+
+        self.base_params = Parameters.get_from_tuple(json.loads(
+            str(arrays["base_params"])))
+        self.action_space = [str(a) for a in arrays["action_space"]]
+        self.p_jam = np.array(self.base_params.p_jam)
+        self.k_values = [int(k) for k in arrays["k_values"]]
+        self.grid = [arrays[f"{name}_values"] for name in GRID_AXES]
+
+        self.state_spaces = {}
+        self.f = {}
+        self.y = {}
+        self.values = {}
+        self.reward_components = {}
+        self.transitions = {}
+        for k in self.k_values:
+            self.state_spaces[k] = [str(x) for x
+                in arrays[f"state_space_{k}"]]
+            self.f[k] = arrays[f"f_{k}"]
+            self.y[k] = arrays[f"y_{k}"]
+            self.values[k] = arrays[f"values_{k}"]
+            self.reward_components[k] = arrays[f"reward_components_{k}"]
+            self.transitions[k] = arrays[f"transitions_{k}"]
+
+    def evaluate(self, k: int, c: float, l: float, f: np.ndarray, 
+            y: np.ndarray):
+        """
+        Returns the objective function for the strategies f and y (as 
+        arrays) under costs c and l.
+        """
+        r0, rc, rl = self.reward_components[k]
+        return float(np.sum(evaluate_values(r0 + c * rc + l * rl, 
+            self.transitions[k], f, y)))
+
+    def query(self, k: int, p_avg: float, c: float, l: float):
+        """
+        Returns the strategies (f, y) for the given parameters, and an
+        estimate of their interpolation error.
+
+        At a grid point, these are the stored equilibrium strategies (with an
+        error of 0). Between grid points, they are interpolated
+        (multilinearly) from the surrounding grid points, renormalized and
+        projected onto the jammer's power constraint. If the strategies of 
+        the nearest grid point (projected in the same way) have a lower 
+        objective function under the queried parameters, those are returned
+        instead. The error estimate is the difference between the objective
+        function of the returned strategies and the objective function 
+        interpolated from the surrounding grid points.
+
+        Each axis is searched with binary search, so a query takes
+        O(log n) time for a grid of n points (plus the size of f).
+        """
+        validate_param("strategy index query", "k in the index", True,
+            k in self.f)
+
+        corners = []
+        for name, values, value in zip(GRID_AXES, self.grid,
+                [p_avg, c, l]):
+            validate_param("strategy index query",
+                f"{values[0]} <= {name} <= {values[-1]}", True,
+                values[0] <= value <= values[-1])
+
+            upper = np.searchsorted(values, value)
+            if values[upper] == value:
+                corners.append([(upper, 1)])
+            else:
+                weight = (value - values[upper - 1]) / (values[upper]
+                    - values[upper - 1])
+                corners.append([(upper - 1, 1 - weight), (upper, weight)])
+
+        cell = list(itertools.product(*corners))
+        indices = tuple(np.array([[i for i, _ in corner]
+            for corner in cell]).T)
+
+        if len(cell) == 1:
+            # An exact entry
+            f = self.f[k][indices][0]
+            y = self.y[k][indices][0]
+            error = 0
+        else:
+            weights = np.array([np.prod([w for _, w in corner])
+                for corner in cell])
+            f_corners = self.f[k][indices]
+            y_corners = self.y[k][indices]
+            f = np.einsum("i,ixa->xa", weights, f_corners)
+            y = weights @ y_corners
+
+            # Interpolating strategies keeps them on the simplex and (since
+            # the power constraint is linear in p_avg) within the power
+            # constraint, up to rounding
+            f = np.maximum(f, 0)
+            f /= np.sum(f, axis = -1, keepdims = True)
+            y = np.maximum(y, 0)
+            y /= np.sum(y)
+            if y @ self.p_jam > p_avg:
+                y = project_jammer_strategy(y, self.p_jam, p_avg)
+            value = self.evaluate(k, c, l, f, y)
+
+            nearest = np.argmax(weights)
+            nearest_f = f_corners[nearest]
+            nearest_y = y_corners[nearest]
+            if nearest_y @ self.p_jam > p_avg:
+                nearest_y = project_jammer_strategy(nearest_y, self.p_jam, 
+                    p_avg)
+            nearest_value = self.evaluate(k, c, l, nearest_f, nearest_y)
+            if nearest_value < value:
+                f, y, value = nearest_f, nearest_y, nearest_value
+
+            error = abs(value - weights @ self.values[k][indices])
+
+        f_dict = {state: {action: float(f[i, j]) for j, action
+            in enumerate(self.action_space)}
+            for i, state in enumerate(self.state_spaces[k])}
+        return f_dict, [float(p) for p in y], float(error)
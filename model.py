@@ -1,7 +1,31 @@
-import math
+import math, sys
 import numpy as np
+from collections import OrderedDict
 from parameters import Parameters, validate_param
 
+# Tables shared between Model instances, keyed by the table's name and the
+# parameters that it depends on, with their (estimated) sizes in bytes. The
+# least recently used tables are dropped once the tables take more than 
+# TABLE_CACHE_BYTES in total. A model keeps its own tables either way.
+TABLE_CACHE_BYTES = 512 * 2 ** 20
+table_cache = OrderedDict()
+table_cache_bytes = 0
+
+def get_table_size(table):
+    """
+    Estimates the memory used by a table (an array, or nested dicts and 
+    lists of arrays and numbers), in bytes.
+    """
+    if isinstance(table, np.ndarray):
+        return table.nbytes
+    if isinstance(table, dict):
+        return sys.getsizeof(table) + sum(get_table_size(value) 
+            for value in table.values())
+    if isinstance(table, (list, tuple)):
+        return sys.getsizeof(table) + sum(get_table_size(value) 
+            for value in table)
+    return sys.getsizeof(table)
+
 class Model:
     def __init__(self, params: Parameters = Parameters()):
 
@@ -9,8 +33,161 @@ class Model:
         self.state_space = self.get_state_space()
         self.action_space = self.get_action_space()
 
-        # Do calculations now to avoid repetition
-        self.transition_probabilities = {
+        # The tables below are only calculated when first accessed, and are 
+        # shared with any other model whose relevant parameters match. They
+        # should be treated as read-only.
+        self.tables = {}
+
+    @property
+    def transition_probabilities(self):
+        return self.get_table("transition_probabilities", 
+            self.get_transition_key(), self.create_transition_probabilities)
+
+    @property
+    def transmitter_payoffs(self):
+        return self.get_table("transmitter_payoffs", self.get_payoff_key(),
+            self.create_transmitter_payoffs)
+
+    @property
+    def transmitter_rewards(self):
+        return self.get_table("transmitter_rewards", self.get_reward_key(),
+            self.create_transmitter_rewards)
+
+    @property
+    def reward_matrices(self):
+        return self.get_table("reward_matrices", self.get_reward_key(),
+            self.create_reward_matrices)
+
+    @property
+    def transition_tensor(self):
+        """
+        P(x'|x, a1, a2) as an array indexed by [x, a1, a2, x'].
+        """
+        return self.get_table("transition_tensor", self.get_transition_key(),
+            self.create_transition_tensor)
+
+    @property
+    def reward_components(self):
+        """
+        The rewards r(x, a1, a2) are affine in the hopping cost c and the 
+        jamming cost l. This is an array of (R0, Rc, Rl), each indexed by 
+        [x, a1, a2], such that the rewards are R0 + c * Rc + l * Rl.
+        """
+        return self.get_table("reward_components", self.get_transition_key(),
+            self.create_reward_components)
+
+    @property
+    def reward_tensor(self):
+        """
+        r(x, a1, a2) as an array indexed by [x, a1, a2].
+        """
+        return self.get_table("reward_tensor", self.get_reward_key(),
+            lambda: self.get_reward_tensor(self.params.c, self.params.l))
+
+    @property
+    def state_weights(self):
+        """
+        The number of states of the full model that each state stands for
+        (see LumpedModel).
+        """
+        return np.ones(len(self.state_space))
+
+    def find_lumpable_partition(self, tolerance: float = 0):
+        """
+        Returns the coarsest partition of the state space into blocks of 
+        equivalent states: states with the same rewards (for any hopping and
+        jamming costs) and the same probability of moving to each block, for
+        every action and jammer power. Values that differ by less than about
+        `tolerance` are treated as equal.
+
+        Found by partition refinement, starting from the blocks of states 
+        with equal rewards. Returns a list of blocks (lists of states), in 
+        the order of their first states.
+        """
+        transitions = self.transition_tensor
+        rewards = np.moveaxis(self.reward_components, 1, 0)
+        state_count = len(self.state_space)
+
+        def get_blocks(signatures: np.ndarray):
+            if tolerance > 0:
+                signatures = np.round(signatures / tolerance)
+            _, first, labels = np.unique(signatures, axis = 0, 
+                return_index = True, return_inverse = True)
+            # Number the blocks in the order of their first states
+            order = np.argsort(np.argsort(first))
+            return order[labels.ravel()]
+
+        labels = get_blocks(rewards.reshape(state_count, -1))
+        while True:
+            block_count = labels.max() + 1
+            block_transitions = np.stack([transitions[..., labels == block]
+                .sum(axis = -1) for block in range(block_count)], axis = -1)
+            new_labels = get_blocks(np.concatenate([labels[:, np.newaxis],
+                block_transitions.reshape(state_count, -1)], axis = 1))
+
+            if new_labels.max() + 1 == block_count:
+                break
+            labels = new_labels
+
+        return [[state for state, label in zip(self.state_space, labels) 
+            if label == block] for block in range(block_count)]
+
+    def get_table(self, name: str, key: tuple, create: callable):
+        """
+        Returns the table called `name`, calling `create` to calculate it 
+        only if neither this model nor any other model with the same `key`
+        has done so already.
+        """
+        try:
+            return self.tables[name]
+        except KeyError:
+            pass
+
+        global table_cache_bytes
+
+        cache_key = (name, key)
+        if cache_key in table_cache:
+            table_cache.move_to_end(cache_key)
+        else:
+            table = create()
+            size = get_table_size(table)
+            table_cache[cache_key] = (table, size)
+            table_cache_bytes += size
+
+            # The new table stays, even if it is larger than the limit
+            while table_cache_bytes > TABLE_CACHE_BYTES and len(
+                    table_cache) > 1:
+                _, (_, dropped_size) = table_cache.popitem(last = False)
+                table_cache_bytes -= dropped_size
+
+        self.tables[name] = table_cache[cache_key][0]
+        return self.tables[name]
+
+    def get_transition_key(self):
+        """
+        The parameters that the transition probabilities depend on. These do
+        not include the hopping and jamming costs.
+        """
+        params = self.params
+        return (params.k, params.n, params.m, tuple(params.p_jam), 
+            tuple(params.sinr_limits), params.p_recv, params.alpha, 
+            params.sigma_squared)
+
+    def get_payoff_key(self):
+        """
+        The parameters that the transmitter's payoffs depend on.
+        """
+        params = self.params
+        return (params.k, params.n, params.m, params.c, params.l)
+
+    def get_reward_key(self):
+        """
+        The parameters that the transmitter's rewards depend on.
+        """
+        return self.get_transition_key() + (self.params.c, self.params.l)
+
+    def create_transition_probabilities(self):
+        return {
             state: {
                 action: [
                     self.get_transition_probabilities(state, action, pj) \
@@ -19,7 +196,8 @@ class Model:
             } for state in self.state_space
         }
 
-        self.transmitter_payoffs = {
+    def create_transmitter_payoffs(self):
+        return {
             action: [
                 {
                     new_state: self.get_immediate_transmitter_payoff(action, 
@@ -29,7 +207,8 @@ class Model:
             ] for action in self.action_space
         }
 
-        self.transmitter_rewards = {
+    def create_transmitter_rewards(self):
+        return {
             state: {
                 action: [
                     self.get_immediate_transmitter_reward(state, action, pj) \
@@ -38,10 +217,50 @@ class Model:
             } for state in self.state_space
         }
 
-        self.reward_matrices = {
+    def create_reward_matrices(self):
+        return {
             state: self.get_reward_matrix(state) for state in self.state_space
         }
 
+    def create_transition_tensor(self):
+        return np.array([
+            [
+                [
+                    [probs[x_prime] for x_prime in self.state_space]
+                    for probs in self.transition_probabilities[state][action]
+                ] for action in self.action_space
+            ] for state in self.state_space
+        ])
+
+    def create_reward_components(self):
+        payoff_components = np.array([
+            [
+                [
+                    self.get_payoff_components(action, pj, new_state)
+                    for new_state in self.state_space
+                ] for pj in range(self.params.m + 1)
+            ] for action in self.action_space
+        ])
+
+        # Equation 13, for each component of the payoff
+        return np.einsum("sajx,ajxi->isaj", self.transition_tensor, 
+            payoff_components)
+
+    def get_reward_tensor(self, c = None, l = None):
+        """
+        Returns r(x, a1, a2) for hopping cost(s) `c` and jamming cost(s) `l`
+        (which default to the model's parameters), indexed by [..., x, a1, a2]
+        where the leading dimensions are those of `c` and `l` broadcast 
+        together. For example, `c` with shape (C, 1) and `l` with shape (L,)
+        give the rewards for a C x L grid of costs.
+        """
+        c = np.asarray(self.params.c if c is None else c, dtype = float)
+        l = np.asarray(self.params.l if l is None else l, dtype = float)
+        r0, rc, rl = self.reward_components
+
+        return (r0 + c[..., np.newaxis, np.newaxis, np.newaxis] * rc 
+            + l[..., np.newaxis, np.newaxis, np.newaxis] * rl)
+
     def get_state_space(self):
         
         states = ["j"]
@@ -61,27 +280,39 @@ class Model:
         Listed as U(., a1, a2, x') in the paper.
         """
 
+        base, hop, jam = self.get_payoff_components(action, 
+            jammer_power_index, next_state)
+
+        return base + hop * self.params.c + jam * self.params.l
+
+    def get_payoff_components(self, action: str, jammer_power_index: int, 
+            next_state: str):
+        """
+        Returns the coefficients (u0, uc, ul) of U(., a1, a2, x') such that
+        U(., a1, a2, x') = u0 + c * uc + l * ul.
+        """
+
         r = int(action[1:])
 
         # Equation 8
         if (next_state == "j" and action[0] == "h" 
                 and jammer_power_index > self.params.m - r):
-            return - self.params.l - self.params.c
+            return 0, -1, -1
 
         elif (next_state == "1" and action[0] == "h" 
                 and jammer_power_index <= self.params.m - r):
-            return r - self.params.c
+            return r, -1, 0
 
         elif (next_state == "j" and action[0] == "s"
                 and jammer_power_index > self.params.m - r):
-            return - self.params.l
+            return 0, 0, -1
 
         elif (next_state != "j" and action[0] == "s"
                 and jammer_power_index <= self.params.m - r):
-            return r
+            return r, 0, 0
         
         else:
-            return 0
+            return 0, 0, 0
 
     def get_transition_probabilities(self, state: str, action: str,
             jammer_power_index: int):
@@ -159,23 +390,93 @@ class Model:
 
     def get_transition_matrix(self, state: str, value_function: callable):
         """
-        Listed as T(x) in the paper.
+        Listed as T(x) in the paper. This reads the transition tensor, so 
+        that a model attached to shared memory (see shared_model) does not 
+        need the nested dicts of transition probabilities.
+        """
+
+        next_state_values = np.array([value_function(x_prime) for x_prime 
+            in self.state_space])
+
+        return self.transition_tensor[self.state_space.index(state)] \
+            @ next_state_values
+
+class LumpedModel(Model):
+    def __init__(self, params: Parameters = Parameters(), 
+            tolerance: float = 0):
+        """
+        A reduced model with one state for each block of equivalent states
+        of the full model (see Model.find_lumpable_partition), named after 
+        the first state of the block. Each state is weighted by the size of
+        its block in the objective function, so a strategy that is optimal 
+        here expands (with `expand_strategy`) to one for the full model.
+
+        If no two states are equivalent (as with the transitions of the 
+        paper, for any parameters tried so far), this model has the same 
+        tables as the full model, and shares them through the table cache 
+        instead of calculating them again.
         """
+        self.full_model = Model(params)
+        self.blocks = self.full_model.find_lumpable_partition(tolerance)
 
-        matrix = []
-        next_state_values = {x_prime: value_function(x_prime) for x_prime 
-            in self.state_space}
+        super().__init__(params)
+        self.state_space = [block[0] for block in self.blocks]
+        self.block_of = {state: block[0] for block in self.blocks 
+            for state in block}
 
-        for action in self.action_space:
-            matrix.append([])
-            for jammer_power_index in range(0, self.params.m + 1):
-                transition_probabilities = (self.transition_probabilities \
-                    [state][action][jammer_power_index])
-                matrix[-1].append(sum([transition_probabilities[x_prime] 
-                    * next_state_values[x_prime] 
-                    for x_prime in self.state_space]))
+    @property
+    def state_weights(self):
+        return np.array([len(block) for block in self.blocks], dtype = float)
 
-        return np.array(matrix)
+    def get_transition_key(self):
+        return super().get_transition_key() + self.get_block_key()
+
+    def get_payoff_key(self):
+        return super().get_payoff_key() + self.get_block_key()
+
+    def get_block_key(self):
+        """
+        What is added to the keys of the full model's tables (nothing if 
+        the tables are those of the full model).
+        """
+        if len(self.blocks) == len(self.full_model.state_space):
+            return ()
+        return (("lumped",) + tuple(tuple(block) for block in self.blocks),)
+
+    def create_transition_probabilities(self):
+        full_probabilities = self.full_model.transition_probabilities
+
+        def lump(probs: dict):
+            lumped = {state: 0 for state in self.state_space}
+            for state, p in probs.items():
+                if state in self.block_of:
+                    lumped[self.block_of[state]] += p
+            return lumped
+
+        return {
+            state: {
+                action: [lump(probs) for probs 
+                    in full_probabilities[state][action]]
+                for action in self.action_space
+            } for state in self.state_space
+        }
+
+    def create_transmitter_rewards(self):
+        return {state: self.full_model.transmitter_rewards[state] 
+            for state in self.state_space}
+
+    def create_reward_components(self):
+        indices = [self.full_model.state_space.index(state) 
+            for state in self.state_space]
+        return self.full_model.reward_components[:, indices]
+
+    def expand_strategy(self, f: dict):
+        """
+        Returns the transmit strategy `f` of this model as a strategy of the
+        full model, where each state follows the strategy of its block.
+        """
+        return {state: dict(f[self.block_of[state]]) 
+            for state in self.full_model.state_space}
 
 ################################## VALIDATION ##################################
 
@@ -198,18 +499,24 @@ def validate_transmit_strategy(model: Model, f: dict,
 
     def transmit_validate(p_name: str, expected, actual):
         validate_param("transmit strategy", p_name, expected, actual)
-    
+
+    # Messages are only formatted for checks that fail
     for state in state_space:
+        probabilities = f[state]
         action_p_sum = 0
         for action in action_space:
-            p = f[state][action]
-            transmit_validate(f"0 <= f[{state}][{action}] <= 1", 
-                True, 0 <= p and p <= 1)
+            p = probabilities[action]
+            if not (0 <= p and p <= 1):
+                transmit_validate(f"0 <= f[{state}][{action}] <= 1", 
+                    True, False)
             action_p_sum += p
-        transmit_validate(f"sum of f[\"{state}\"]", 1, action_p_sum if 
-            precision < 0 else round(action_p_sum, precision))
-        transmit_validate(f"number of actions in f[\"{state}\"]", 
-            len(action_space), len(f[state]))
+        if precision >= 0:
+            action_p_sum = round(action_p_sum, precision)
+        if action_p_sum != 1:
+            transmit_validate(f"sum of f[\"{state}\"]", 1, action_p_sum)
+        if len(probabilities) != len(action_space):
+            transmit_validate(f"number of actions in f[\"{state}\"]", 
+                len(action_space), len(probabilities))
 
     transmit_validate("number of states in f", len(state_space), len(f))
 
@@ -228,8 +535,10 @@ def validate_jammer_strategy(model: Model, y: 'list[float]',
 
     jammer_validate("number of elements", params.m + 1, len(y))
 
+    # Messages are only formatted for checks that fail
     for i, yi in enumerate(y):
-        jammer_validate(f"0 <= y[{i}] <= 1", True, 0 <= yi and yi <= 1)
+        if not (0 <= yi and yi <= 1):
+            jammer_validate(f"0 <= y[{i}] <= 1", True, False)
 
     jammer_validate("sum of elements", 1, sum(y) if precision < 0 else 
         round(sum(y), precision))
@@ -237,4 +546,134 @@ def validate_jammer_strategy(model: Model, y: 'list[float]',
     avg_power = np.dot(params.p_jam, y)
 
     jammer_validate("power constraint satisfied", True, (avg_power
-        if precision < 0 else round(avg_power, precision)) <= params.p_avg)
\ No newline at end of file
+        if precision < 0 else round(avg_power, precision)) <= params.p_avg)
+
+def validate_transmit_strategies(model: Model, f: np.ndarray, 
+        precision: int = -1):
+    """
+    A vectorized version of validate_transmit_strategy, for any number of 
+    transmit strategies at once, given as an array indexed by [..., x, a1] 
+    (in the order of the model's state and action spaces). Throws a 
+    ValueError for the first invalid strategy found.
+    """
+    f = np.asarray(f)
+    state_space = model.state_space
+    action_space = model.action_space
+
+    def transmit_validate(p_name: str, expected, actual):
+        validate_param("transmit strategies", p_name, expected, actual)
+
+    transmit_validate("shape of f[..., x, a1]", (len(state_space), 
+        len(action_space)), f.shape[-2:])
+
+    out_of_bounds = (f < 0) | (f > 1) | np.isnan(f)
+    if out_of_bounds.any():
+        *index, x, a = np.argwhere(out_of_bounds)[0]
+        transmit_validate(f"0 <= {format_index('f', index)}" + 
+            f"[{state_space[x]}][{action_space[a]}] <= 1", True, False)
+
+    sums = np.sum(f, axis = -1)
+    if precision >= 0:
+        sums = np.round(sums, precision)
+    wrong_sums = sums != 1
+    if wrong_sums.any():
+        *index, x = np.argwhere(wrong_sums)[0]
+        transmit_validate(f"sum of {format_index('f', index)}" + 
+            f"[\"{state_space[x]}\"] ({np.count_nonzero(wrong_sums)} " + 
+            "invalid sums)", 1, sums[tuple(index) + (x,)])
+
+def validate_jammer_strategies(model: Model, y: np.ndarray, 
+        precision: int = -1):
+    """
+    A vectorized version of validate_jammer_strategy, for any number of 
+    jammer strategies at once, given as an array indexed by [..., a2]. 
+    Throws a ValueError for the first invalid strategy found.
+    """
+    y = np.asarray(y)
+    params = model.params
+
+    def jammer_validate(p_name: str, expected, actual):
+        validate_param("jammer strategies", p_name, expected, actual)
+
+    jammer_validate("number of elements", params.m + 1, y.shape[-1])
+
+    out_of_bounds = (y < 0) | (y > 1) | np.isnan(y)
+    if out_of_bounds.any():
+        *index, i = np.argwhere(out_of_bounds)[0]
+        jammer_validate(f"0 <= {format_index('y', index)}[{i}] <= 1", 
+            True, False)
+
+    sums = np.sum(y, axis = -1)
+    avg_power = y @ np.array(params.p_jam)
+    if precision >= 0:
+        sums = np.round(sums, precision)
+        avg_power = np.round(avg_power, precision)
+
+    wrong_sums = sums != 1
+    if wrong_sums.any():
+        index = tuple(np.argwhere(wrong_sums)[0])
+        jammer_validate(f"sum of {format_index('y', index)} " + 
+            f"({np.count_nonzero(wrong_sums)} invalid sums)", 1, 
+            sums[index])
+
+    over_power = ~(avg_power <= params.p_avg)
+    if over_power.any():
+        index = tuple(np.argwhere(over_power)[0])
+        jammer_validate("power constraint satisfied by " + 
+            f"{format_index('y', index)} " + 
+            f"({np.count_nonzero(over_power)} over the limit)", True, False)
+
+def format_index(name: str, index: tuple):
+    return name + "".join(f"[{int(i)}]" for i in index)
+
+def project_to_simplex(v: np.ndarray):
+    """
+    Euclidean projection of each vector along the last axis of `v` onto the
+    probability simplex.
+    """
+    v = np.asarray(v, dtype = float)
+    u = -np.sort(-v, axis = -1)
+    cumulative = np.cumsum(u, axis = -1) - 1
+    indices = np.arange(1, v.shape[-1] + 1)
+    count = np.sum(u - cumulative / indices > 0, axis = -1, keepdims = True)
+    threshold = np.take_along_axis(cumulative, count - 1, axis = -1) / count
+    return np.maximum(v - threshold, 0)
+
+def project_jammer_strategy(y: np.ndarray, p_jam: 'list[float]', 
+        p_avg: float, iterations: int = 60):
+    """
+    Euclidean projection of each jammer strategy along the last axis of `y`
+    onto the strategies that satisfy validate_jammer_strategy: the
+    probability simplex intersected with the power constraint. `p_jam` and
+    `p_avg` may also be given for each strategy, indexed by [..., a2] and
+    [...] to broadcast with y.
+    
+    The projection is the simplex projection of y - mu * p_jam, for the 
+    smallest multiplier mu >= 0 that meets the power constraint, which is 
+    found by bisection (for every strategy at once).
+    """
+    y = np.asarray(y, dtype = float)
+    p_jam = np.asarray(p_jam, dtype = float)
+
+    def power(mu: np.ndarray):
+        return np.sum(project_to_simplex(y - mu * p_jam) * p_jam, axis = -1)
+
+    lower = np.zeros(y.shape[:-1] + (1,))
+    upper = np.ones_like(lower)
+    feasible_at_zero = (power(lower) <= p_avg)[..., np.newaxis]
+
+    # Find a feasible upper bound on the multiplier for each strategy
+    for _ in range(iterations):
+        infeasible = power(upper) > p_avg
+        if not infeasible.any():
+            break
+        upper = np.where(infeasible[..., np.newaxis], 2 * upper, upper)
+
+    for _ in range(iterations):
+        middle = (lower + upper) / 2
+        feasible = (power(middle) <= p_avg)[..., np.newaxis]
+        upper = np.where(feasible, middle, upper)
+        lower = np.where(feasible, lower, middle)
+
+    mu = np.where(feasible_at_zero, 0, upper)
+    return project_to_simplex(y - mu * p_jam)
@@ -0,0 +1,178 @@
+import math
+import numpy as np
+
+from jammers import Jammer, SweepJammer
+from model import Model, validate_jammer_strategies, validate_transmit_strategy
+
+class MultiLinkSimulation:
+    def __init__(self, fs: 'list[dict]', y: 'list[float]', model: Model,
+            initial_state: str = "j", precision: int = -1,
+            shared_jammer: bool = True, contention: bool = True,
+            seed: int = None, jammer: Jammer = None, copies: int = 1):
+        """
+        Simulates L transmitter/receiver links at once, with the state of
+        every link held in arrays so that each turn costs O(L).
+
+        Parameters:
+         - `fs`: the transmit strategy of each link (one per link)
+         - `y`: the jammer strategy, or (without a shared jammer) a list
+                containing a jammer strategy for each link
+         - `shared_jammer`: if True, all links hop over the same k channels
+                and face a single jammer, which sweeps them and reacts to
+                the ACK/NACKs that it overhears on any link. Otherwise, each
+                link faces its own jammer.
+         - `contention`: if True (and the jammer is shared), links that
+                transmit on the same channel in the same turn collide and
+                all of their transmissions fail
+         - `seed`: the seed for the simulation's random number generator
+         - `jammer`: the behaviour of the jammers (see jammers.py), by
+                default a SweepJammer
+         - `copies`: the number of independent links that play each
+                transmit strategy in `fs` (the links of each strategy are
+                consecutive)
+
+        With the default jammer and without a shared jammer, each link 
+        plays the same game as Simulation. A shared jammer follows the same 
+        rules, except that its single-channel attack only affects links on
+        the attacked channel (see SweepJammer).
+        """
+
+        self.model = model
+        self.params = model.params
+        params = self.params
+
+        for f in fs:
+            validate_transmit_strategy(model, f, precision)
+
+        y = np.array(y, dtype = float)
+        validate_jammer_strategies(model, y, precision)
+        if y.ndim == 1:
+            y = y[np.newaxis, :]
+
+        self.link_count = len(fs) * copies
+        self.shared_jammer = shared_jammer
+        self.contention = contention and shared_jammer
+        self.rng = np.random.default_rng(seed)
+
+        # Each link belongs to the group of the jammer that it faces
+        self.jammer_count = 1 if shared_jammer else self.link_count
+        self.groups = (np.zeros(self.link_count, dtype = int) if shared_jammer
+            else np.arange(self.link_count))
+
+        if shared_jammer and len(y) != 1:
+            raise ValueError("A shared jammer requires a single jammer " +
+                "strategy.")
+        self.power_cdf = np.cumsum(np.broadcast_to(y,
+            (self.jammer_count, params.m + 1)), axis = 1)
+
+        self.action_cdf = np.repeat(np.cumsum([[[f[state][action] for action
+            in model.action_space] for state in model.state_space]
+            for f in fs], axis = 2), copies, axis = 0)
+
+        self.initial_state = model.state_space.index(initial_state)
+        self.block_count = math.ceil(params.k / params.n)
+        self.rates = np.array(params.rates)
+        self.sinr_limits = np.array(params.sinr_limits)
+        self.single_attack_sinr = np.array([
+            params.get_single_channel_attack_sinr(i)
+            for i in range(params.m + 1)])
+
+        self.jammer = SweepJammer() if jammer is None else jammer
+        self.reset()
+
+    def reset(self):
+        L = self.link_count
+        params = self.params
+
+        self.states = np.full(L, self.initial_state)
+        self.total_tx_reward = np.zeros(L)
+        self.message_success_count = np.zeros(L, dtype = int)
+
+        # Each link has its own PN sequence
+        self.current_pn_index = np.zeros(L, dtype = int)
+        self.pn_sequence = self.rng.integers(0, params.k, (L, params.t))
+
+        self.current_tx_channel = self.pn_sequence[:, 0].copy()
+        self.current_tx_rate_index = np.full(L, params.m)
+
+        self.jammer.reset(self)
+
+    def play_turn(self):
+        params = self.params
+        links = np.arange(self.link_count)
+        groups = self.groups
+
+        # Send/receive a message on every link
+        channel = self.current_tx_channel
+        rate_index = self.current_tx_rate_index
+        jammer_power_index = self.jammer.draw_power_indices()
+        link_power_index = jammer_power_index[groups]
+        jammer_on_channel, single_jam = self.jammer.get_channel_status(
+            channel)
+
+        message_was_jammed = (jammer_on_channel
+            & (link_power_index > params.m - rate_index)) | (single_jam
+            & (self.single_attack_sinr[link_power_index]
+                <= self.sinr_limits[rate_index]))
+
+        message_failed = message_was_jammed
+        if self.contention:
+            _, inverse, counts = np.unique(channel, return_inverse = True,
+                return_counts = True)
+            message_failed = message_failed | (counts[inverse] > 1)
+
+        # Add reward (loss) for successful transmission (interception)
+        self.total_tx_reward += np.where(message_failed, -params.l,
+            self.rates[rate_index])
+        self.message_success_count += ~message_failed
+
+        # Determine whether each jammer overheard an ACK or NACK
+        overheard_links = links[jammer_on_channel]
+        overheard_nack = np.bincount(groups[jammer_on_channel
+            & message_failed], minlength = self.jammer_count) > 0
+        overheard_ack = np.bincount(groups[jammer_on_channel
+            & ~message_failed], minlength = self.jammer_count) > 0
+        overheard_ack &= ~overheard_nack
+
+        # Compute the new states
+        self.states = np.where(message_failed, 0,
+            np.minimum(self.states + 1, len(self.model.state_space) - 1))
+
+        # Choose the next actions
+        action_cdf = self.action_cdf[links, self.states]
+        tx_action = (self.rng.random((self.link_count, 1))
+            >= action_cdf).sum(axis = 1).clip(max = 2 * params.m + 1)
+        hop = tx_action > params.m
+
+        # Hop to a new channel
+        self.states[hop] = 0
+        self.current_pn_index[hop] = ((self.current_pn_index[hop] + 1)
+            % params.t)
+        new_channel = channel.copy()
+        new_channel[hop] = self.pn_sequence[hop, self.current_pn_index[hop]]
+        self.total_tx_reward[hop] -= params.c
+
+        self.current_tx_channel = new_channel
+        self.current_tx_rate_index = tx_action % (params.m + 1)
+
+        # Update the jammers
+        self.jammer.update(channel, overheard_links, overheard_ack,
+            overheard_nack, jammer_power_index)
+
+    def run(self):
+        """
+        Play a game of the specified length and return (1) the total
+        transmitter reward and (2) the percent success of each link, as
+        arrays. Resets the simulation to the original state after run is
+        complete.
+        """
+        game_time = 0
+        while game_time < self.params.t:
+            self.play_turn()
+            game_time += 1
+
+        reward = self.total_tx_reward
+        successes = self.message_success_count
+        self.reset()
+
+        return reward / self.params.t, successes / self.params.t
@@ -1,10 +1,11 @@
-import time
+import os, pickle, time
 from markov import QTable
-from model import Model
-from parameters import Parameters
-from post_optimization import confirm, simulate
+from model import LumpedModel, Model, project_jammer_strategy
+from parameters import Parameters, validate_param
 
-from scipy.optimize import minimize, LinearConstraint
+# This module is imported by worker processes that only need the solver, so 
+# SciPy is imported by the functions that need it, and the interactive parts
+# (post_optimization, which imports matplotlib) only when run as a script.
 import numpy as np
 from copy import deepcopy
 from threading import Thread
@@ -13,6 +14,13 @@ DELTA = 0.6
 TIME_AHEAD = 5 # How many timesteps ahead to consider (before ending recursion)
 ROUND_PRECISION = 4 # Must be greater than or equal to 2 (see rounding in main)
 GENTLE_STOPPING = True
+SOLVER_METHODS = ["slsqp", "softmax"]
+POWER_PENALTY = 1e4 # Weight of the squared excess power (softmax method)
+CHECKPOINT_INTERVAL = 300 # Seconds between checkpoints of find_equilibrium
+BATCH_ITERATIONS = 2000 # Most iterations of find_equilibria for each point
+BATCH_PATIENCE = 100 # Iterations without improvement before a point stops
+BATCH_TOLERANCE = 1e-4 # Smallest relative improvement that find_equilibria
+                       # counts as one
 
 stop_optimization = False
 optimization_not_complete = True
@@ -35,6 +43,112 @@ class StoppableFunction():
         self.last_input = x
         return self.function(x)
 
+class Checkpointer():
+    def __init__(self, path: str, params: Parameters, method: str = "slsqp",
+            time_ahead: int = None, interval: float = CHECKPOINT_INTERVAL,
+            lump_states: bool = False):
+        """
+        Keeps track of the best iterate of find_equilibrium (as a strategy
+        vector) and the number of iterations, and saves them with the solver
+        settings to `path` at most every `interval` seconds, so that a long
+        optimization can be resumed with optimize_game(..., resume = True).
+        """
+        self.path = path
+        self.interval = interval
+        self.settings = {
+            "params": params.convert_to_tuple(),
+            "method": method,
+            "time_ahead": TIME_AHEAD if time_ahead is None else time_ahead,
+            "lump_states": lump_states
+        }
+
+        self.iterations = 0
+        self.best_input = None
+        self.best_value = np.inf
+        self.last_save_time = time.time()
+
+    def resume(self):
+        """
+        Loads the latest checkpoint, if there is one, and returns its best
+        iterate (or None). Raises a ValueError if the checkpoint was saved
+        with different parameters, a different TIME_AHEAD or a different
+        `lump_states`.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                checkpoint = pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+        for setting in ["params", "time_ahead", "lump_states"]:
+            validate_param("checkpoint", setting, self.settings[setting], 
+                checkpoint["settings"].get(setting, False))
+
+        self.iterations = checkpoint["iterations"]
+        self.best_input = checkpoint["best_input"]
+        self.best_value = checkpoint["best_value"]
+        return self.best_input
+
+    def create_callback(self, model: Model, 
+            progress: OptimizationProgress = None, 
+            convert_input: callable = None):
+        """
+        Returns a callback for scipy.optimize.minimize that records each 
+        iterate, converted to a strategy vector with `convert_input` if 
+        given. The jammer strategy is projected onto the power constraint 
+        before it is recorded, with the objective function (without any 
+        penalty) of the projected strategies, so that the best value is 
+        comparable whichever method is used.
+        """
+        p_jam = np.array(model.params.p_jam)
+        f_shape = (len(model.state_space), len(model.action_space))
+        f_size = f_shape[0] * f_shape[1]
+
+        def callback(xk):
+            if progress is not None:
+                progress(xk)
+
+            x = np.array(xk if convert_input is None else convert_input(xk),
+                dtype = float)
+            f = x[:f_size].reshape(f_shape)
+            y = project_jammer_strategy(x[f_size:], p_jam, 
+                model.params.p_avg)
+            value, _, _ = evaluate_gradient(model.reward_tensor, 
+                model.transition_tensor, f, y, self.settings["time_ahead"],
+                model.state_weights)
+            self.record(np.concatenate([f.ravel(), y]), float(value))
+
+        return callback
+
+    def record(self, x: 'list[float]', value: float):
+        self.iterations += 1
+        if value < self.best_value:
+            self.best_input = np.array(x, dtype = float)
+            self.best_value = value
+
+        if time.time() - self.last_save_time >= self.interval:
+            self.save()
+
+    def save(self, complete: bool = False):
+        """
+        Saves the checkpoint, replacing any previous one atomically so that
+        an interrupted save cannot leave a corrupted checkpoint behind.
+        """
+        checkpoint = {
+            "settings": self.settings,
+            "iterations": self.iterations,
+            "best_input": self.best_input,
+            "best_value": self.best_value,
+            "complete": complete,
+            "saved_at": time.time()
+        }
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as file:
+            pickle.dump(checkpoint, file)
+        os.replace(temp_path, self.path)
+        self.last_save_time = time.time()
+
 class MemoryFunctions():
     """
     Provides major performance improvements for the recursive functions
@@ -54,31 +168,39 @@ class MemoryFunctions():
         
     I'm not completely sure, but I think this changes the objective function's
     time complexity from exponential to linear.
+
+    The remembered values are kept in an array indexed by [function, depth,
+    state], for depths up to `time_ahead` (TIME_AHEAD by default).
     """
 
-    def __init__(self, model: Model):
+    def __init__(self, model: Model, time_ahead: int = None):
         self.model = model
         self.function_count = 2
+        self.time_ahead = TIME_AHEAD if time_ahead is None else time_ahead
+        self.state_indices = {state: i for i, state 
+            in enumerate(model.state_space)}
 
     def reset(self, f: dict, y: 'list[float]'):
         self.f = f
         self.y = y
-        self.history = []
-        for _ in range(2):
-            self.history.append({x: {} for x in self.model.state_space})
+        self.history = np.full((self.function_count, self.time_ahead + 1, 
+            len(self.model.state_space)), np.nan)
 
     def get(self, funcId: int, x: str, depth: int = 0):
-        try:
-            return self.history[funcId][x][str(depth)]
-        except KeyError:
-            pass
+        if depth > self.time_ahead:
+            return 0
+
+        index = (funcId, depth, self.state_indices[x])
+        res = self.history.item(index)
+        if res == res: # Not NaN, so already calculated
+            return res
         
         # We haven't done this calculation yet
         res = (best_transmitter_value(self, x, self.y, depth) 
             if funcId == 0 
             else best_jammer_value(self, x, self.f, depth))
         
-        self.history[funcId][x][str(depth)] = res
+        self.history[index] = res
         return res
 
 def convert_strategies_to_list(f: dict, y: 'list[float]'):
@@ -109,6 +231,16 @@ def convert_list_to_strategies(model: Model, vector: 'list'):
 
     return f, y
 
+def convert_strategies_to_arrays(model: Model, f: dict, y: 'list[float]'):
+    """
+    Returns f as an array indexed by [x, a1] and y as an array indexed by
+    [a2], in the order of the model's state and action spaces.
+    """
+    f_array = np.array([[f[state][action] for action in model.action_space]
+        for state in model.state_space], dtype = float)
+
+    return f_array, np.array(y, dtype = float)
+
 def best_transmitter_value(memfunc: MemoryFunctions, state: str,
         y: 'list[float]', exponent: int = 0):
     """
@@ -116,7 +248,7 @@ def best_transmitter_value(memfunc: MemoryFunctions, state: str,
     """
     model = memfunc.model
 
-    if exponent > TIME_AHEAD:
+    if exponent > memfunc.time_ahead:
         return 0
 
     return max(
@@ -134,7 +266,7 @@ def best_jammer_value(memfunc: MemoryFunctions, state: str,
     """
     model = memfunc.model
 
-    if exponent > TIME_AHEAD:
+    if exponent > memfunc.time_ahead:
         return 0
 
     action_probs = [-f[state][action] for action in f[state]]
@@ -154,10 +286,219 @@ def objective_function(x, memfunc: MemoryFunctions):
 
     memfunc.reset(f, y)
 
-    return sum([memfunc.get(0, state) + memfunc.get(1, state) 
-        for state in model.state_space])
+    return sum([weight * (memfunc.get(0, state) + memfunc.get(1, state))
+        for state, weight in zip(model.state_space, model.state_weights)])
+
+def evaluate_values(rewards: np.ndarray, transitions: np.ndarray, 
+        f: np.ndarray, y: np.ndarray, time_ahead: int = None):
+    """
+    A vectorized version of V_1 and V_2 (Equation 22) at depth 0, calculated
+    bottom-up instead of recursively. The arguments are arrays of
+    r(x, a1, a2) indexed by [..., x, a1, a2], P(x'|x, a1, a2) indexed by 
+    [..., x, a1, a2, x'], f indexed by [..., x, a1] and y indexed by 
+    [..., a2], where the leading dimensions are broadcast together. 
+
+    Returns (V_1, V_2), each indexed by [..., x].
+    """
+    if time_ahead is None:
+        time_ahead = TIME_AHEAD
+
+    transmitter_rewards, transmitter_transitions, jammer_rewards, \
+        jammer_transitions = get_expected_tables(rewards, transitions, f, y)
+
+    v1 = np.zeros(transmitter_rewards.shape[:-1])
+    v2 = np.zeros(jammer_rewards.shape[:-1])
+
+    for depth in range(time_ahead, -1, -1):
+        discount = DELTA ** depth
+        v1 = np.max(transmitter_rewards + discount * np.einsum(
+            "...sax,...x->...sa", transmitter_transitions, v1), axis = -1)
+        v2 = np.max(jammer_rewards + discount * np.einsum(
+            "...sjx,...x->...sj", jammer_transitions, v2), axis = -1)
+
+    return v1, v2
+
+def get_expected_tables(rewards: np.ndarray, transitions: np.ndarray, 
+        f: np.ndarray, y: np.ndarray):
+    """
+    Returns the rewards and transition probabilities of each player's
+    actions, in expectation over the other player's strategy (with the
+    jammer's rewards negated), as used by V_1 and V_2.
+    """
+    # The transition tables are contracted as matrix products, which is 
+    # much faster than einsum for arrays with leading dimensions
+    return (np.einsum("...saj,...j->...sa", rewards, y),
+        np.matmul(y[..., np.newaxis, np.newaxis, np.newaxis, :], 
+            transitions)[..., 0, :],
+        -np.einsum("...sa,...saj->...sj", f, rewards),
+        -np.matmul(f[..., np.newaxis, np.newaxis, :], 
+            np.swapaxes(transitions, -3, -2))[..., 0, :])
+
+def evaluate_horizons(rewards: np.ndarray, transitions: np.ndarray, 
+        f: np.ndarray, y: np.ndarray, time_ahead: int = None):
+    """
+    Like evaluate_values, but for every horizon from 0 to `time_ahead` 
+    (TIME_AHEAD by default) in a single bottom-up pass. The values for all
+    horizons are updated together, and each horizon's values stay zero
+    until the pass reaches its own last depth.
+
+    Returns (V_1, V_2), each indexed by [..., horizon, x].
+    """
+    if time_ahead is None:
+        time_ahead = TIME_AHEAD
+
+    transmitter_rewards, transmitter_transitions, jammer_rewards, \
+        jammer_transitions = get_expected_tables(rewards, transitions, f, y)
+    horizons = np.arange(time_ahead + 1)[:, np.newaxis]
+
+    v1 = np.zeros(transmitter_rewards.shape[:-2] + horizons.shape[:1] + 
+        transmitter_rewards.shape[-2:-1])
+    v2 = np.zeros(jammer_rewards.shape[:-2] + horizons.shape[:1] + 
+        jammer_rewards.shape[-2:-1])
+
+    for depth in range(time_ahead, -1, -1):
+        discount = DELTA ** depth
+        v1 = np.where(depth <= horizons, np.max(
+            transmitter_rewards[..., np.newaxis, :, :] + discount * 
+            np.einsum("...sax,...hx->...hsa", transmitter_transitions, v1), 
+            axis = -1), 0)
+        v2 = np.where(depth <= horizons, np.max(
+            jammer_rewards[..., np.newaxis, :, :] + discount * 
+            np.einsum("...sjx,...hx->...hsj", jammer_transitions, v2), 
+            axis = -1), 0)
+
+    return v1, v2
+
+def evaluate_gradient(rewards: np.ndarray, transitions: np.ndarray, 
+        f: np.ndarray, y: np.ndarray, time_ahead: int = None,
+        state_weights: np.ndarray = None, best_actions: tuple = None):
+    """
+    Returns the objective function (the sum of V_1 and V_2 over all states,
+    weighted by `state_weights` if given) with the same arguments as 
+    evaluate_values, and its gradient with respect to f and y. Each max is
+    differentiated at the action that attains it, so where several actions
+    tie this is one of the subgradients.
+
+    If `best_actions` (from get_best_actions) is given, each max is taken 
+    at those actions instead, which gives one smooth (polynomial) piece of 
+    the objective function and its exact gradient.
+
+    Returns (objective, d/df, d/dy), indexed by [...], [..., x, a1] and 
+    [..., a2].
+    """
+    if time_ahead is None:
+        time_ahead = TIME_AHEAD
+
+    v1, v2, best1, best2, transmitter_transitions, jammer_transitions = \
+        evaluate_best_actions(rewards, transitions, f, y, time_ahead, 
+        best_actions)
+
+    # Then propagate the gradient top-down, through the best actions
+    if state_weights is None:
+        state_weights = np.ones(v1[0].shape[-1])
+    weight1 = np.broadcast_to(state_weights, v1[0].shape)
+    weight2 = np.broadcast_to(state_weights, v2[0].shape)
+    d_f = 0
+    d_y = 0
+
+    for depth in range(time_ahead + 1):
+        discount = DELTA ** depth
+
+        # The rewards plus the discounted values of the next states, for 
+        # each (x, a1, a2). Contracting the transitions with the values 
+        # first (as a matrix product) is much faster than one einsum.
+        q1 = rewards + discount * np.matmul(transitions, 
+            v1[depth + 1][..., np.newaxis, np.newaxis, :, np.newaxis])[..., 0]
+        q2 = rewards + discount * np.matmul(transitions, 
+            v2[depth + 1][..., np.newaxis, np.newaxis, :, np.newaxis])[..., 0]
+        chosen1 = weight1[..., np.newaxis] * best1[depth]
+        chosen2 = weight2[..., np.newaxis] * best2[depth]
+
+        # V_1 depends on y through the rewards and transitions of the best
+        # transmitter actions
+        d_y = d_y + np.einsum("...sa,...saj->...j", chosen1, q1)
+        weight1 = discount * np.einsum("...sa,...sax->...x", chosen1, 
+            transmitter_transitions)
+
+        # V_2 depends on f through the rewards and transitions of the best
+        # jammer actions
+        d_f = d_f - np.einsum("...sj,...saj->...sa", chosen2, q2)
+        weight2 = discount * np.einsum("...sj,...sjx->...x", chosen2, 
+            jammer_transitions)
+
+    return np.sum((v1[0] + v2[0]) * state_weights, axis = -1), d_f, d_y
+
+def get_best_actions(rewards: np.ndarray, transitions: np.ndarray, 
+        f: np.ndarray, y: np.ndarray, time_ahead: int = None):
+    """
+    Returns the actions that attain each max of V_1 and V_2 (with the same
+    arguments as evaluate_values), for evaluate_gradient.
+    """
+    if time_ahead is None:
+        time_ahead = TIME_AHEAD
+
+    _, _, best1, best2, _, _ = evaluate_best_actions(rewards, transitions, 
+        f, y, time_ahead)
+    return best1, best2
+
+def evaluate_best_actions(rewards: np.ndarray, transitions: np.ndarray, 
+        f: np.ndarray, y: np.ndarray, time_ahead: int, 
+        best_actions: tuple = None):
+    """
+    Calculates V_1 and V_2 at every depth bottom-up, remembering the best 
+    actions (as one-hot arrays indexed by [..., x, a], one for each depth),
+    or taking each max at `best_actions` if given. Returns the values and 
+    best actions of each player, and the expected transitions of each 
+    player's actions.
+    """
+    transmitter_rewards, transmitter_transitions, jammer_rewards, \
+        jammer_transitions = get_expected_tables(rewards, transitions, f, y)
+
+    v1 = [np.zeros(transmitter_rewards.shape[:-1])]
+    v2 = [np.zeros(jammer_rewards.shape[:-1])]
+    best1 = []
+    best2 = []
+
+    for depth in range(time_ahead, -1, -1):
+        discount = DELTA ** depth
+        q1 = transmitter_rewards + discount * np.einsum(
+            "...sax,...x->...sa", transmitter_transitions, v1[0])
+        q2 = jammer_rewards + discount * np.einsum(
+            "...sjx,...x->...sj", jammer_transitions, v2[0])
+
+        if best_actions is None:
+            best1.insert(0, np.argmax(q1, axis = -1)[..., np.newaxis] == 
+                np.arange(q1.shape[-1]))
+            best2.insert(0, np.argmax(q2, axis = -1)[..., np.newaxis] == 
+                np.arange(q2.shape[-1]))
+        else:
+            best1.insert(0, best_actions[0][depth])
+            best2.insert(0, best_actions[1][depth])
+        v1.insert(0, np.sum(q1 * best1[0], axis = -1))
+        v2.insert(0, np.sum(q2 * best2[0], axis = -1))
+
+    return v1, v2, best1, best2, transmitter_transitions, jammer_transitions
+
+def evaluate_cost_grid(model: Model, f: dict, y: 'list[float]', 
+        c_values: 'list[float]', l_values: 'list[float]'):
+    """
+    Returns the value of the objective function for the strategies f and y
+    at every hopping cost in `c_values` and jamming cost in `l_values`, as an
+    array indexed by [c, l]. Uses a single vectorized pass, since only the 
+    rewards depend on the costs (and do so linearly).
+    """
+    f_array, y_array = convert_strategies_to_arrays(model, f, y)
+    c_values = np.asarray(c_values, dtype = float)
+    rewards = model.get_reward_tensor(c_values[:, np.newaxis], l_values)
+
+    v1, v2 = evaluate_values(rewards, model.transition_tensor, f_array, 
+        y_array)
+
+    return np.sum((v1 + v2) * model.state_weights, axis = -1)
 
 def create_constraints(model: Model, vec_size: int):
+    from scipy.optimize import LinearConstraint
+
     constraints = []
     action_count = len(model.action_space)
     vector_offset = 0
@@ -197,29 +538,228 @@ def create_random_strategies(model: Model):
     y = [1 / rate_count for _ in range(rate_count)]
     return q_table, y 
 
-def find_equilibrium(model: Model, show_output: bool):
+def find_equilibrium(model: Model, show_output: bool, time_ahead: int = None,
+        x0: 'list[float]' = None, method: str = "slsqp", 
+        checkpointer: Checkpointer = None):
+    """
+    Minimizes the objective function from x0 (by default, uniformly random
+    strategies), saving checkpoints with `checkpointer` if given, using 
+    either:
+     - "slsqp": SLSQP, with the constraints from create_constraints and the
+                bounds from create_bounds
+     - "softmax": L-BFGS over the logits of each state's action 
+                distribution and of the jammer strategy, with a penalty on
+                the jammer's excess power (see minimize_softmax)
+    """
     global optimization_not_complete
+
+    from scipy.optimize import minimize
+
+    if method not in SOLVER_METHODS:
+        raise ValueError(f"Invalid solver method. Expected one of " + 
+            f"{SOLVER_METHODS}, got \"{method}\".")
     
-    f, y = create_random_strategies(model)
-    x0 = convert_strategies_to_list(f, y)
+    if x0 is None:
+        f, y = create_random_strategies(model)
+        x0 = convert_strategies_to_list(f, y)
+
+    progress = OptimizationProgress() if show_output else None
+
+    if method == "softmax":
+        result = minimize_softmax(model, x0, time_ahead, progress, 
+            checkpointer)
+        optimization_not_complete = False
+        return result
 
     constraints = create_constraints(model, len(x0))
     bounds = create_bounds(len(x0))
 
-    progress = OptimizationProgress() if show_output else None
-
-    memfunc = MemoryFunctions(model)
+    memfunc = MemoryFunctions(model, time_ahead)
     fun = StoppableFunction(lambda x: objective_function(x, memfunc))
+    callback = (progress if checkpointer is None 
+        else checkpointer.create_callback(model, progress))
 
     try:
         result = minimize(fun, x0, bounds=bounds, constraints=constraints, 
-            callback=progress).x
+            callback=callback).x
+        if checkpointer is not None:
+            checkpointer.save(complete = True)
     except StopIteration:
         result = fun.last_input
+        if checkpointer is not None:
+            checkpointer.save()
     
     optimization_not_complete = False
     return result
 
+def softmax(logits: np.ndarray):
+    exp = np.exp(logits - np.max(logits, axis = -1, keepdims = True))
+    return exp / np.sum(exp, axis = -1, keepdims = True)
+
+def minimize_softmax(model: Model, x0: 'list[float]', time_ahead: int = None,
+        callback: callable = None, checkpointer: Checkpointer = None):
+    """
+    Minimizes the objective function without constraints, by writing each 
+    state's action distribution and the jammer strategy as the softmax of 
+    their logits, so that L-BFGS can be used with the gradient from 
+    evaluate_gradient. The power constraint is replaced by a penalty of 
+    POWER_PENALTY times the squared excess power, and the final jammer 
+    strategy is projected onto the constraint with project_jammer_strategy.
+    Unless it is stopped, L-BFGS is followed by minimize_adam (see the 
+    comment below), and the best of those points is returned.
+
+    Returns the strategies as a vector, like find_equilibrium.
+    """
+    from scipy.optimize import minimize
+
+    params = model.params
+    rewards = model.reward_tensor
+    transitions = model.transition_tensor
+    p_jam = np.array(params.p_jam)
+    f_shape = (len(model.state_space), len(model.action_space))
+    f_size = f_shape[0] * f_shape[1]
+
+    def convert_logits(z: np.ndarray):
+        return softmax(z[:f_size].reshape(f_shape)), softmax(z[f_size:])
+
+    def penalized_objective(z: np.ndarray):
+        f, y = convert_logits(z)
+        value, d_f, d_y = evaluate_gradient(rewards, transitions, f, y, 
+            time_ahead, model.state_weights)
+
+        excess = max(0, y @ p_jam - params.p_avg)
+        value += POWER_PENALTY * excess ** 2
+        d_y = d_y + 2 * POWER_PENALTY * excess * p_jam
+
+        # Through the softmax
+        d_f = f * (d_f - np.sum(f * d_f, axis = -1, keepdims = True))
+        d_y = y * (d_y - np.sum(y * d_y))
+        return value, np.concatenate([d_f.ravel(), d_y])
+
+    # Strategies that are exactly 0 have logits of -inf, so start close
+    z0 = np.log(np.maximum(np.array(x0, dtype = float), 1e-9))
+    fun = StoppableFunction(penalized_objective)
+    if checkpointer is not None:
+        callback = checkpointer.create_callback(model, callback, 
+            lambda z: np.concatenate([s.ravel() for s in convert_logits(z)]))
+
+    stopped = False
+    try:
+        z = minimize(fun, z0, jac = True, method = "L-BFGS-B", 
+            callback = callback).x
+        if checkpointer is not None:
+            checkpointer.save(complete = True)
+    except StopIteration:
+        z = fun.last_input
+        stopped = True
+        if checkpointer is not None:
+            checkpointer.save()
+
+    f, y = convert_logits(z)
+    y = project_jammer_strategy(y, p_jam, params.p_avg)
+
+    if not stopped:
+        # L-BFGS often stops early on this nonsmooth objective, so also run
+        # Adam, both from where L-BFGS stopped and from uniform strategies 
+        # (where the softmax is not saturated), and keep whichever point has
+        # the lowest objective (after projecting y)
+        value = evaluate_gradient(rewards, transitions, f, y, time_ahead, 
+            model.state_weights)[0]
+        starts = np.stack([z, np.zeros_like(z)])
+        polished_f, polished_y, polished_values, _, _ = minimize_adam(
+            np.stack([rewards] * 2), np.stack([transitions] * 2), 
+            np.stack([p_jam] * 2), np.full(2, params.p_avg), 
+            starts[:, :f_size].reshape((2,) + f_shape), starts[:, f_size:],
+            time_ahead, model.state_weights)
+        best = np.argmin(polished_values)
+        if polished_values[best] < value:
+            f, y = polished_f[best], polished_y[best]
+
+    return np.concatenate([f.ravel(), y])
+
+def minimize_adam(rewards: np.ndarray, transitions: np.ndarray, 
+        p_jam: np.ndarray, p_avg: np.ndarray, f_logits: np.ndarray, 
+        y_logits: np.ndarray, time_ahead: int = None, 
+        state_weights: np.ndarray = None, iterations: int = BATCH_ITERATIONS,
+        patience: int = BATCH_PATIENCE, tolerance: float = BATCH_TOLERANCE, 
+        learning_rate: float = 0.1, show_output: bool = False):
+    """
+    Minimizes the same penalized objective over the logits of the 
+    strategies as minimize_softmax, for a batch of games stacked along the 
+    first axis of every argument (p_jam and p_avg included), starting from
+    `f_logits` and `y_logits`. Uses Adam, which only needs the gradient of 
+    each game, so that the games stay independent.
+
+    A game has converged once its best objective has not improved by more 
+    than `tolerance` (relative to its size) in `patience` iterations, and 
+    then drops out of the batch. The best iterate of each game is kept, and
+    its jammer strategy is projected onto the power constraint at the end.
+
+    Returns (1) f and (2) y as arrays indexed by [game, x, a1] and 
+    [game, a2], (3) their (unpenalized) objective function, (4) whether 
+    each game converged and (5) its number of iterations.
+    """
+    batch = len(rewards)
+    logits = [np.array(f_logits, dtype = float), 
+        np.array(y_logits, dtype = float)]
+    moments = [np.zeros_like(z) for z in logits]
+    second_moments = [np.zeros_like(z) for z in logits]
+
+    best_value = np.full(batch, np.inf)
+    best_f = softmax(logits[0])
+    best_y = softmax(logits[1])
+    last_improvement = np.zeros(batch, dtype = int)
+    iteration_counts = np.zeros(batch, dtype = int)
+    active = np.ones(batch, dtype = bool)
+
+    for iteration in range(1, iterations + 1):
+        points = np.flatnonzero(active)
+        if len(points) == 0:
+            break
+
+        f = softmax(logits[0][points])
+        y = softmax(logits[1][points])
+        value, d_f, d_y = evaluate_gradient(rewards[points], 
+            transitions[points], f, y, time_ahead, state_weights)
+
+        excess = np.maximum(0, np.sum(y * p_jam[points], axis = -1) 
+            - p_avg[points])
+        value += POWER_PENALTY * excess ** 2
+        d_y = d_y + 2 * POWER_PENALTY * excess[:, np.newaxis] * p_jam[points]
+
+        improved = value < best_value[points]
+        significant = value < best_value[points] - tolerance * np.maximum(1, 
+            np.abs(value))
+        best_value[points[improved]] = value[improved]
+        best_f[points[improved]] = f[improved]
+        best_y[points[improved]] = y[improved]
+        last_improvement[points[significant]] = iteration
+        iteration_counts[points] = iteration
+
+        # Through the softmax, then an Adam step on the logits
+        gradients = [f * (d_f - np.sum(f * d_f, axis = -1, keepdims = True)),
+            y * (d_y - np.sum(y * d_y, axis = -1, keepdims = True))]
+        for z, m, v, g in zip(logits, moments, second_moments, gradients):
+            m[points] = 0.9 * m[points] + 0.1 * g
+            v[points] = 0.999 * v[points] + 0.001 * g ** 2
+            step = (m[points] / (1 - 0.9 ** iteration)) / (np.sqrt(
+                v[points] / (1 - 0.999 ** iteration)) + 1e-8)
+            z[points] -= learning_rate * step
+
+        active[points] = iteration - last_improvement[points] < patience
+
+        if show_output:
+            print(f"Iteration {iteration}: {active.sum()} of {batch} " + 
+                "points left", end = "\r")
+
+    if show_output:
+        print()
+
+    best_y = project_jammer_strategy(best_y, p_jam, p_avg)
+    values, _, _ = evaluate_gradient(rewards, transitions, best_f, best_y, 
+        time_ahead, state_weights)
+    return best_f, best_y, values, ~active, iteration_counts
+
 def round_strategies(f: dict, y: 'list[float]', decimal_places: int):
     """
     Rounds the strategies to the specified precision and returns the new 
@@ -233,11 +773,24 @@ def round_strategies(f: dict, y: 'list[float]', decimal_places: int):
         for action in f[state]:
             f[state][action] = round(f[state][action], decimal_places)
     for i in range(len(y)):
-        y[i] = round(y[i], decimal_places)
+        y[i] = float(round(y[i], decimal_places))
 
     return f, y
 
-def optimize_game(params = Parameters(k = 10), show_output = False):
+def optimize_game(params = Parameters(k = 10), show_output = False, 
+        method = "slsqp", checkpoint_path: str = None, resume: bool = False,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL, 
+        lump_states: bool = False):
+    """
+    Finds the equilibrium strategies (f, y) for `params`, rounded to 
+    ROUND_PRECISION decimal places. If `checkpoint_path` is given, the best
+    iterate so far is saved there every `checkpoint_interval` seconds, and
+    with `resume`, the search restarts from the checkpoint (if it exists).
+
+    With `lump_states`, the game is solved on a LumpedModel (one state for 
+    each block of equivalent states), and f is expanded back to every 
+    state of the returned model.
+    """
 
     start_time = time.time()
 
@@ -245,12 +798,32 @@ def optimize_game(params = Parameters(k = 10), show_output = False):
         print(f"\nTIME_AHEAD = {TIME_AHEAD}")
         print("Optimizing the game... (CTRL-C to stop)")
 
-    model = Model(params)
-    eq = find_equilibrium(model, show_output)
+    model = LumpedModel(params) if lump_states else Model(params)
+    x0 = None
+    checkpointer = None
+
+    if show_output and lump_states:
+        print(f"Lumped {len(model.full_model.state_space)} states into " + 
+            f"{len(model.state_space)}")
+
+    if checkpoint_path is not None:
+        checkpointer = Checkpointer(checkpoint_path, params, method, 
+            interval = checkpoint_interval, lump_states = lump_states)
+        if resume:
+            x0 = checkpointer.resume()
+            if show_output and x0 is not None:
+                print(f"Resuming after {checkpointer.iterations} iterations")
+
+    eq = find_equilibrium(model, show_output, x0 = x0, method = method, 
+        checkpointer = checkpointer)
 
     f, y = convert_list_to_strategies(model, eq)
     f, y = round_strategies(f, y, decimal_places = ROUND_PRECISION)
 
+    if lump_states:
+        f = model.expand_strategy(f)
+        model = model.full_model
+
     if show_output:
         print("\n\nTRANSMITTER STRATEGY: ")
         print(f)
@@ -263,12 +836,113 @@ def optimize_game(params = Parameters(k = 10), show_output = False):
 
     return model, f, y
 
+def sweep_horizons(params: Parameters, time_ahead: int = None, 
+        show_output: bool = False, warm_start: bool = False):
+    """
+    Finds an equilibrium for every horizon from 0 to `time_ahead` 
+    (TIME_AHEAD by default), as optimize_game would. With `warm_start`, each
+    search starts from the equilibrium of the previous horizon instead, which
+    is faster but can stop at a worse solution.
+    
+    Returns a list indexed by horizon, of dicts with the rounded strategies
+    "f" and "y", and "values": the objective function of those strategies 
+    at every horizon (from one pass of evaluate_horizons), so that 
+    "values"[h] is the objective at the horizon the strategies were found for.
+    """
+    if time_ahead is None:
+        time_ahead = TIME_AHEAD
+
+    model = Model(params)
+    results = []
+    x0 = None
+
+    for horizon in range(time_ahead + 1):
+        if show_output:
+            print(f"\nHorizon {horizon} of {time_ahead}")
+
+        x0 = find_equilibrium(model, show_output, horizon, 
+            x0 if warm_start else None)
+        f, y = convert_list_to_strategies(model, x0)
+        f, y = round_strategies(f, y, decimal_places = ROUND_PRECISION)
+
+        f_array, y_array = convert_strategies_to_arrays(model, f, y)
+        v1, v2 = evaluate_horizons(model.reward_tensor, 
+            model.transition_tensor, f_array, y_array, time_ahead)
+
+        results.append({
+            "f": f,
+            "y": y,
+            "values": np.sum(v1 + v2, axis = -1)
+        })
+
+    return results
+
+def stack_models(params_list: 'list[Parameters]'):
+    """
+    Returns a Model for each of the Parameters in `params_list`, with their
+    reward and transition tensors stacked along a new leading axis. Every 
+    point must have the same k, n and m, so that the models have the same 
+    state and action spaces.
+    """
+    models = [Model(params) for params in params_list]
+    first = params_list[0]
+    for params in params_list:
+        validate_param("batch of parameters", "(k, n, m)", 
+            (first.k, first.n, first.m), (params.k, params.n, params.m))
+
+    return (models, np.stack([model.reward_tensor for model in models]), 
+        np.stack([model.transition_tensor for model in models]))
+
+def find_equilibria(params_list: 'list[Parameters]', time_ahead: int = None,
+        iterations: int = BATCH_ITERATIONS, patience: int = BATCH_PATIENCE,
+        tolerance: float = BATCH_TOLERANCE, learning_rate: float = 0.1,
+        show_output: bool = False):
+    """
+    Finds an equilibrium for every point in `params_list` at once, by 
+    stacking their tensors (see stack_models) and minimizing with 
+    minimize_adam, so that each iteration is a single call to 
+    evaluate_gradient for the whole batch.
+
+    Returns a list in the order of `params_list`, of dicts with the rounded
+    strategies "f" and "y", the objective function "value" (before 
+    rounding), whether the point "converged" within `iterations` 
+    iterations, and its number of "iterations".
+    """
+    models, rewards, transitions = stack_models(params_list)
+    p_jam = np.array([params.p_jam for params in params_list])
+    p_avg = np.array([params.p_avg for params in params_list])
+    batch, state_count, action_count, power_count = rewards.shape
+
+    f, y, values, converged, iteration_counts = minimize_adam(rewards, 
+        transitions, p_jam, p_avg, np.zeros((batch, state_count, 
+        action_count)), np.zeros((batch, power_count)), time_ahead, 
+        iterations = iterations, patience = patience, tolerance = tolerance,
+        learning_rate = learning_rate, show_output = show_output)
+
+    results = []
+    for i, model in enumerate(models):
+        strategies = convert_list_to_strategies(model, 
+            np.concatenate([f[i].ravel(), y[i]]))
+        point_f, point_y = round_strategies(*strategies, 
+            decimal_places = ROUND_PRECISION)
+        results.append({
+            "f": point_f,
+            "y": point_y,
+            "value": float(values[i]),
+            "converged": bool(converged[i]),
+            "iterations": int(iteration_counts[i])
+        })
+
+    return results
+
 def run_optimization():
     global model, f, y
     model, f, y = optimize_game(show_output = True)
 
 if __name__ == "__main__":
 
+    from post_optimization import confirm, simulate
+
     if GENTLE_STOPPING:
 
         run = Thread(target=run_optimization)
@@ -1,5 +1,5 @@
 from model import Model
-from simulation import Simulation
+from simulation import Simulation, control_variate_estimate
 
 import matplotlib.pyplot as plt
 from statistics import mean, median, stdev
@@ -7,19 +7,27 @@ from tqdm import tqdm
 
 def simulate(model: Model, f: dict, y: 'list[float]', precision: int = -1):
     
-    simulation = Simulation(f, y, model, precision = precision)
+    simulation = Simulation(f, y, model, precision = precision, 
+        control_variate = True)
     tx_rewards = []
     tx_successes = []
+    tx_reward_controls = []
 
     for _ in tqdm(range(2000)):
         reward, success = simulation.run()
         tx_rewards.append(reward)
         tx_successes.append(success)
+        tx_reward_controls.append(simulation.last_reward_control)
         
+    cv_mean, cv_error = control_variate_estimate(tx_rewards, 
+        tx_reward_controls)
+
     print(f"Average reward per unit time over entire simulation\n"+
           f"MEAN: {round(mean(tx_rewards), 4)}, " + 
           f"MEDIAN: {round(median(tx_rewards), 4)}, " +
-          f"STDEV: {round(stdev(tx_rewards), 4)}"
+          f"STDEV: {round(stdev(tx_rewards), 4)}\n" +
+          f"CONTROL VARIATE MEAN: {round(cv_mean, 4)} " +
+          f"(STANDARD ERROR: {round(cv_error, 4)})"
     )
 
     print(f"Success rate\n"+
@@ -0,0 +1,208 @@
+import heapq, itertools
+import numpy as np
+from copy import copy
+
+from model import Model
+from optimize import convert_strategies_to_arrays, optimize_game
+from parameters import Parameters, validate_param
+
+REFINE_TOLERANCE = 0.05 # Largest change between the corners of a final cell
+REFINE_BUDGET = 100 # Most calls to optimize_game in one sweep
+REFINE_DEPTH = 6 # Most times that a cell of the coarse grid is halved
+
+def get_point_parameters(base_params: Parameters, names: 'list[str]',
+        point: tuple):
+    """
+    Returns a copy of `base_params` with each parameter in `names` set to the
+    matching value of `point`.
+    """
+    params = copy(base_params)
+    for name, value in zip(names, point):
+        setattr(params, name, value)
+    params.calculate_sinr_limits()
+    params.calculate_p_jam()
+    return params
+
+def get_stationary_summary(model: Model, f: np.ndarray, y: np.ndarray):
+    """
+    Returns the transmitter's expected reward per unit time, probability of
+    hopping and mean rate index under the strategies f and y (as arrays), in
+    the long run: under the stationary distribution of the states. As in 
+    Simulation, a success in the last state stays there.
+    """
+    # The probability of a success in the last state, which leaves the
+    # state space as the transitions are coded (and so is missing from the 
+    # rewards too)
+    missing = 1 - np.sum(model.transition_tensor, axis = -1)
+    last_state = model.state_space[-1]
+    last_payoffs = np.array([[model.transmitter_payoffs[action][pj][last_state]
+        for pj in range(model.params.m + 1)] 
+        for action in model.action_space])
+
+    transitions = np.einsum("sa,sajx,j->sx", f, model.transition_tensor, y)
+    transitions[-1, -1] += np.einsum("a,aj,j->", f[-1], missing[-1], y)
+
+    # Solve pi P = pi with the probabilities summing to 1
+    count = len(model.state_space)
+    system = np.vstack([transitions.T - np.eye(count), np.ones(count)])
+    target = np.concatenate([np.zeros(count), [1]])
+    stationary = np.linalg.lstsq(system, target, rcond = None)[0]
+
+    hops = np.array([action[0] == "h" for action in model.action_space])
+    rates = np.array([int(action[1:]) for action in model.action_space])
+    rewards = np.einsum("sa,saj,j->s", f, model.reward_tensor 
+        + missing * last_payoffs, y)
+    return (float(stationary @ rewards), float(stationary @ f @ hops), 
+        float(stationary @ f @ rates))
+
+def solve_point(params: Parameters, method: str):
+    """
+    Solves the game for `params`, and returns the rounded strategies "f" and
+    "y" with the transmitter's long-run "reward", "hop_probability" and 
+    "mean_rate_index" under them (see get_stationary_summary).
+    """
+    model, f, y = optimize_game(params, method = method)
+    reward, hop_probability, mean_rate_index = get_stationary_summary(model,
+        *convert_strategies_to_arrays(model, f, y))
+
+    return {
+        "f": f,
+        "y": y,
+        "reward": reward,
+        "hop_probability": hop_probability,
+        "mean_rate_index": mean_rate_index,
+        "m": params.m
+    }
+
+def get_difference(first: dict, second: dict):
+    """
+    How much the equilibrium changes between two solved points: the largest
+    of the relative change of the reward, the change of the probability of 
+    hopping and the change of the mean rate index (as a fraction of m).
+    These summaries are compared rather than f itself, since different 
+    solves can reach different strategies with the same outcome.
+    """
+    scale = max(1, abs(first["reward"]), abs(second["reward"]))
+    return max(abs(first["reward"] - second["reward"]) / scale,
+        abs(first["hop_probability"] - second["hop_probability"]),
+        abs(first["mean_rate_index"] - second["mean_rate_index"]) 
+            / max(first["m"], second["m"]))
+
+def split_interval(lower, upper):
+    """
+    Returns the halves of [lower, upper], or the interval itself if it
+    cannot be split (integer intervals of length 1).
+    """
+    if isinstance(lower, (int, np.integer)) and isinstance(upper,
+            (int, np.integer)):
+        middle = (lower + upper) // 2
+        if middle in (lower, upper):
+            return [(lower, upper)]
+    else:
+        middle = (lower + upper) / 2
+    return [(lower, middle), (middle, upper)]
+
+def refine_sweep(grid: dict, base_params: Parameters = Parameters(),
+        tolerance: float = REFINE_TOLERANCE, budget: int = REFINE_BUDGET,
+        max_depth: int = REFINE_DEPTH, method: str = "softmax",
+        show_output: bool = False):
+    """
+    Sweeps the parameters in `grid` (a dict of parameter names to the values
+    of a coarse grid, with the other parameters from `base_params`), solving
+    more points only where the equilibrium changes a lot.
+
+    Every cell of the grid (a box between neighbouring grid values) whose
+    corners differ by more than `tolerance` (see get_difference) is halved
+    along every parameter, and the new corners are solved. Cells are
+    refined in order of their difference, largest first, until no cell
+    differs by more than `tolerance`, `budget` points have been solved (the
+    points of the coarse grid included, so there must be no more than 
+    `budget` of those), or the cells left have been halved `max_depth` 
+    times. Integer parameters
+    (such as k) are only halved while their intervals are longer than 1.
+
+    Returns a dict with:
+     - "points": a list of dicts, one for each solved point, with the
+            "params" (a dict of the swept parameters), "f", "y", "reward", 
+            "hop_probability" and "mean_rate_index" (see solve_point), in 
+            the order that they were solved
+     - "refinements": a list of the cells that were refined, in order, as
+            dicts with the "lower" and "upper" corners, the "difference"
+            between their corners and their "depth"
+     - "cells": the final cells, as dicts like those of "refinements"
+     - "solves": the number of points solved
+    """
+    names = list(grid)
+    validate_param("refined sweep", "at least one parameter", True,
+        len(names) > 0)
+    for name in names:
+        validate_param("refined sweep", f"at least two values of {name}",
+            True, len(grid[name]) >= 2)
+
+    axes = [sorted(set(grid[name])) for name in names]
+    validate_param("refined sweep", 
+        f"at most {budget} points in the coarse grid", True, 
+        int(np.prod([len(axis) for axis in axes])) <= budget)
+    solved = {}
+
+    def solve(point: tuple):
+        if point not in solved:
+            if show_output:
+                print(f"Solving {dict(zip(names, point))} " +
+                    f"({len(solved) + 1} of at most {budget})")
+            solved[point] = solve_point(get_point_parameters(base_params,
+                names, point), method)
+        return solved[point]
+
+    def get_corners(lower: tuple, upper: tuple):
+        return list(itertools.product(*[sorted({low, high})
+            for low, high in zip(lower, upper)]))
+
+    def get_cell(lower: tuple, upper: tuple, depth: int):
+        corners = [solve(corner) for corner in get_corners(lower, upper)]
+        difference = max([get_difference(first, second) for first, second
+            in itertools.combinations(corners, 2)], default = 0)
+        return {"lower": lower, "upper": upper, "difference": difference,
+            "depth": depth}
+
+    # The cells of the coarse grid, in a heap ordered by difference
+    # (largest first), with a counter to break ties
+    counter = itertools.count()
+    heap = []
+    for index in itertools.product(*[range(len(axis) - 1) for axis in axes]):
+        cell = get_cell(tuple(axis[i] for axis, i in zip(axes, index)),
+            tuple(axis[i + 1] for axis, i in zip(axes, index)), 0)
+        heapq.heappush(heap, (-cell["difference"], next(counter), cell))
+
+    refinements = []
+    final_cells = []
+
+    while heap:
+        _, _, cell = heapq.heappop(heap)
+        halves = [split_interval(low, high)
+            for low, high in zip(cell["lower"], cell["upper"])]
+        new_points = set(itertools.chain.from_iterable(get_corners(
+            tuple(low for low, _ in sub), tuple(high for _, high in sub))
+            for sub in itertools.product(*halves))) - set(solved)
+
+        if (cell["difference"] <= tolerance or cell["depth"] >= max_depth
+                or all(len(half) == 1 for half in halves)
+                or len(solved) + len(new_points) > budget):
+            final_cells.append(cell)
+            continue
+
+        refinements.append(cell)
+        for sub in itertools.product(*halves):
+            new_cell = get_cell(tuple(low for low, _ in sub),
+                tuple(high for _, high in sub), cell["depth"] + 1)
+            heapq.heappush(heap, (-new_cell["difference"], next(counter),
+                new_cell))
+
+    return {
+        "points": [dict({"params": dict(zip(names, point))}, **{
+            key: value for key, value in result.items() if key != "m"
+        }) for point, result in solved.items()],
+        "refinements": refinements,
+        "cells": final_cells,
+        "solves": len(solved)
+    }
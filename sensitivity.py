@@ -0,0 +1,238 @@
+import numpy as np
+from copy import copy
+
+from model import Model
+from optimize import convert_list_to_strategies, \
+    convert_strategies_to_list, create_bounds, create_constraints, \
+    evaluate_gradient, evaluate_values, get_best_actions
+from parameters import Parameters
+
+SENSITIVITY_PARAMETERS = ["p_avg", "c", "l", "alpha"]
+HESSIAN_CHUNK_SIZE = 32 # Columns of the Hessian calculated at once
+SINGULAR_TOLERANCE = 1e-8 # Smallest eigenvalue of the reduced Hessian, 
+                          # relative to the largest, that is not zero
+
+def perturb_parameter(params: Parameters, name: str, delta: float):
+    """
+    Returns a copy of `params` with `delta` added to the parameter `name`.
+    """
+    params = copy(params)
+    setattr(params, name, getattr(params, name) + delta)
+    params.calculate_sinr_limits()
+    params.calculate_p_jam()
+    return params
+
+def get_batch_objective(params: Parameters):
+    """
+    Returns a function that evaluates the objective function under `params`
+    for every row of a 2D array of strategy vectors at once.
+    """
+    model = Model(params)
+    rewards = model.reward_tensor
+    transitions = model.transition_tensor
+    state_count = len(model.state_space)
+    action_count = len(model.action_space)
+    f_size = state_count * action_count
+
+    def objective(vectors: np.ndarray):
+        vectors = np.atleast_2d(vectors)
+        f = vectors[:, :f_size].reshape(-1, state_count, action_count)
+        v1, v2 = evaluate_values(rewards, transitions, f, vectors[:, f_size:])
+        return np.sum(v1 + v2, axis = -1)
+
+    return objective
+
+def get_batch_gradient(params: Parameters, best_actions: tuple = None):
+    """
+    Returns a function that evaluates the gradient of the objective function
+    (from evaluate_gradient, with the given `best_actions`) under `params` 
+    for every row of a 2D array of strategy vectors at once, as the rows of 
+    a 2D array.
+    """
+    model = Model(params)
+    rewards = model.reward_tensor
+    transitions = model.transition_tensor
+    state_count = len(model.state_space)
+    action_count = len(model.action_space)
+    f_size = state_count * action_count
+
+    def gradient(vectors: np.ndarray):
+        vectors = np.atleast_2d(vectors)
+        f = vectors[:, :f_size].reshape(-1, state_count, action_count)
+        _, d_f, d_y = evaluate_gradient(rewards, transitions, f, 
+            vectors[:, f_size:], best_actions = best_actions)
+        return np.concatenate([d_f.reshape(len(vectors), -1), d_y], 
+            axis = 1)
+
+    return gradient
+
+def get_hessian(gradient: callable, x: np.ndarray, step: float):
+    """
+    The Hessian of the objective function, from central differences of its
+    exact gradient, HESSIAN_CHUNK_SIZE columns at a time (so that memory 
+    stays bounded for large k). The objective function is piecewise 
+    polynomial in the strategies (the transitions and the values of the 
+    next states both depend on them), and at an equilibrium the best 
+    actions tie, so `gradient` should keep the best actions fixed (see 
+    get_batch_gradient) to stay on one piece; this is then exact up to 
+    rounding.
+    """
+    hessian = np.zeros((len(x), len(x)))
+    for start in range(0, len(x), HESSIAN_CHUNK_SIZE):
+        steps = np.eye(len(x))[start:start + HESSIAN_CHUNK_SIZE] * step
+        gradients = gradient(np.concatenate([x + steps, x - steps]))
+        hessian[:, start:start + len(steps)] = (gradients[:len(steps)] 
+            - gradients[len(steps):]).T / (2 * step)
+
+    return (hessian + hessian.T) / 2
+
+def get_constraint_rows(model: Model, vec_size: int):
+    """
+    Returns every constraint from create_constraints and create_bounds as the
+    rows of A x = b, with each row's two bounds. The rows are always in the
+    same order for the same state and action spaces.
+    """
+    rows = []
+    bounds = []
+
+    for constraint in create_constraints(model, vec_size):
+        rows.append(np.ravel(constraint.A))
+        bounds.append((np.ravel(constraint.lb)[0],
+            np.ravel(constraint.ub)[0]))
+
+    identity = np.eye(vec_size)
+    for i, bound in enumerate(create_bounds(vec_size)):
+        rows.append(identity[i])
+        bounds.append(bound)
+
+    return np.array(rows, dtype = float), np.array(bounds, dtype = float)
+
+def get_active_constraints(rows: np.ndarray, bounds: np.ndarray,
+        x: np.ndarray, tolerance: float):
+    """
+    Returns the index of each active constraint at `x`, and the bound that
+    it is active at. The tolerance is relative to the size of each row.
+    """
+    values = rows @ x
+    scale = tolerance * np.sum(np.abs(rows), axis = 1)
+    at_lower = np.abs(values - bounds[:, 0]) <= scale
+    at_upper = np.abs(values - bounds[:, 1]) <= scale
+    active = np.flatnonzero(at_lower | at_upper)
+    return active, np.where(at_lower, 0, 1)[active]
+
+def equilibrium_sensitivity(model: Model, f: dict, y: 'list[float]',
+        parameters: 'list[str]' = SENSITIVITY_PARAMETERS,
+        step: float = 1e-4, tolerance: float = 5e-3, 
+        strategies: bool = True):
+    """
+    Estimates how the value of the objective function at a solved (f, y),
+    and the strategies themselves, change with each of the named 
+    parameters, without solving the game again.
+
+    By the envelope theorem, the derivative of the optimal value is the 
+    derivative of the Lagrangian with respect to the parameter at fixed 
+    strategies: d F/dp + lambda^T (d A/dp x - d b/dp), where lambda are the 
+    KKT multipliers of the constraints that are active at (f, y) (found by 
+    least squares from grad F + A^T lambda = 0).
+
+    The derivatives of the strategies come from differentiating the KKT 
+    conditions on the active set: strategies at a bound stay there, and 
+    the others move along the active constraints, as given by the Hessian 
+    of the objective function reduced to the null space of those 
+    constraints (see get_hessian). The best actions often tie at (f, y), 
+    so this is the Hessian of the piece of the objective function whose
+    best actions are those that evaluate_gradient picks there. If that 
+    reduced Hessian is singular, the KKT conditions do not determine how 
+    the strategies move, and a ValueError is raised; pass `strategies = 
+    False` to get only the derivatives of the value.
+
+    Derivatives with respect to the parameters are taken with central 
+    differences of size `step`, relative to each parameter's magnitude. The
+    default `tolerance` for treating a constraint as active allows for the
+    rounding of the strategies returned by optimize_game.
+
+    Returns a dict mapping each parameter to a dict with the derivative of
+    the "value", and (with `strategies`) the derivatives of "f" and "y", in
+    the same form as f and y.
+    """
+    params = model.params
+    x = np.array(convert_strategies_to_list(f, y), dtype = float)
+    f_size = len(model.state_space) * len(model.action_space)
+    best_actions = get_best_actions(model.reward_tensor, 
+        model.transition_tensor, x[:f_size].reshape(len(model.state_space),
+        -1), x[f_size:])
+    gradient_function = get_batch_gradient(params, best_actions)
+
+    gradient = gradient_function(x)[0]
+    rows, bounds = get_constraint_rows(model, len(x))
+    active, sides = get_active_constraints(rows, bounds, x, tolerance)
+    A = rows[active]
+
+    # The KKT multipliers of the active constraints
+    multipliers = np.linalg.lstsq(A.T, -gradient, rcond = None)[0]
+
+    if strategies:
+        # The bounds are the last rows; strategies at a bound stay there
+        bound_count = len(x)
+        general = active < len(rows) - bound_count
+        free = np.setdiff1d(np.arange(len(x)), 
+            active[~general] - (len(rows) - bound_count))
+        A_free = rows[active[general]][:, free]
+
+        # A basis of the directions that keep the active constraints
+        _, singular_values, vt = np.linalg.svd(A_free)
+        rank = np.sum(singular_values > 1e-10 * max(1, 
+            np.max(singular_values, initial = 0)))
+        null_space = vt[rank:].T
+
+        hessian = get_hessian(gradient_function, x, step)[np.ix_(free, free)]
+        reduced_hessian = null_space.T @ hessian @ null_space
+        eigenvalues = np.abs(np.linalg.eigvalsh(reduced_hessian))
+        flat = np.sum(eigenvalues <= SINGULAR_TOLERANCE * max(1, 
+            np.max(eigenvalues, initial = 0)))
+        if flat > 0:
+            raise ValueError("Strategy sensitivities are undetermined: the "
+                + "reduced Hessian of the objective function is singular " 
+                + f"({flat} of {len(eigenvalues)} free directions have no "
+                + "curvature). Use strategies = False for the value alone.")
+
+    sensitivities = {}
+    for name in parameters:
+        delta = step * max(1, abs(getattr(params, name)))
+        upper = perturb_parameter(params, name, delta)
+        lower = perturb_parameter(params, name, -delta)
+
+        d_objective = (get_batch_objective(upper)(x)[0]
+            - get_batch_objective(lower)(x)[0]) / (2 * delta)
+
+        # The same active constraints, under the perturbed parameters
+        upper_rows, upper_bounds = get_constraint_rows(Model(upper), len(x))
+        lower_rows, lower_bounds = get_constraint_rows(Model(lower), len(x))
+        d_A = (upper_rows[active] - lower_rows[active]) / (2 * delta)
+        d_b = (upper_bounds[active, sides]
+            - lower_bounds[active, sides]) / (2 * delta)
+        d_constraints = d_A @ x - d_b
+
+        sensitivities[name] = {"value": float(d_objective 
+            + multipliers @ d_constraints)}
+        if not strategies:
+            continue
+
+        # Differentiate grad F + A^T lambda = 0 and A x = b on the free
+        # strategies: a step that restores the active constraints, plus 
+        # the step along them that restores stationarity
+        d_gradient = ((get_batch_gradient(upper, best_actions)(x)[0] 
+            - get_batch_gradient(lower, best_actions)(x)[0]) / (2 * delta) 
+            + d_A.T @ multipliers)[free]
+        particular = np.linalg.lstsq(A_free, -d_constraints[general], 
+            rcond = None)[0]
+        along = np.linalg.solve(reduced_hessian, -null_space.T 
+            @ (hessian @ particular + d_gradient))
+
+        d_x = np.zeros(len(x))
+        d_x[free] = particular + null_space @ along
+        d_f, d_y = convert_list_to_strategies(model, d_x.tolist())
+        sensitivities[name]["f"] = d_f
+        sensitivities[name]["y"] = d_y
+
+    return sensitivities
@@ -0,0 +1,206 @@
+import asyncio, time
+import numpy as np
+from collections import Counter, OrderedDict
+
+from model import Model, validate_jammer_strategy, validate_transmit_strategy
+from multilink import MultiLinkSimulation
+from optimize import convert_strategies_to_arrays, evaluate_values
+from parameters import Parameters
+
+MODEL_CACHE_SIZE = 64
+
+class EvaluationRequest:
+    def __init__(self, model: Model, f: dict, y: 'list[float]',
+            mode: str, future: asyncio.Future):
+        self.model = model
+        self.params = model.params
+        self.f = f
+        self.y = y
+        self.mode = mode
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+class ServiceMetrics:
+    def __init__(self):
+        self.request_count = 0
+        self.batch_count = 0
+        self.total_queue_latency = 0
+        self.max_queue_latency = 0
+        self.batch_sizes = Counter()
+
+    def record_batch(self, batch: 'list[EvaluationRequest]'):
+        started_at = time.perf_counter()
+        self.batch_count += 1
+        self.batch_sizes[len(batch)] += 1
+
+        for request in batch:
+            latency = started_at - request.enqueued_at
+            self.request_count += 1
+            self.total_queue_latency += latency
+            self.max_queue_latency = max(self.max_queue_latency, latency)
+
+    def summary(self):
+        return {
+            "requests": self.request_count,
+            "batches": self.batch_count,
+            "mean_batch_size": (self.request_count / self.batch_count
+                if self.batch_count else 0),
+            "max_batch_size": max(self.batch_sizes, default = 0),
+            "mean_queue_latency": (self.total_queue_latency
+                / self.request_count if self.request_count else 0),
+            "max_queue_latency": self.max_queue_latency
+        }
+
+class EvaluationService:
+    def __init__(self, max_batch_size: int = 256, max_delay: float = 0.002,
+            games: int = 10, precision: int = -1):
+        """
+        An in-process asyncio service that evaluates strategies (f, y) under
+        some Parameters. Requests are queued, and those that arrive within
+        `max_delay` seconds of each other are grouped into batches of at
+        most `max_batch_size`:
+         - "exact" requests with the same state and action spaces are
+           evaluated with the objective function in one vectorized pass
+         - "simulate" requests with the same parameters are played as
+           independent links of one MultiLinkSimulation, `games` links per
+           request, each against its own jammer (so that each game is 
+           played as in Simulation)
+
+        Use as:
+            async with EvaluationService() as service:
+                value = await service.evaluate(params, f, y)
+        """
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.games = games
+        self.precision = precision
+
+        self.models = OrderedDict()
+        self.metrics = ServiceMetrics()
+        self.queue = None
+        self.task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.stop()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(
+            self.process_requests())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def evaluate(self, params: Parameters, f: dict, y: 'list[float]',
+            mode: str = "exact"):
+        """
+        Returns the value of the objective function for the strategies f and
+        y if `mode` is "exact", or the mean (reward, success rate) of the
+        transmitter over the simulated games if `mode` is "simulate".
+        """
+        if mode not in ["exact", "simulate"]:
+            raise ValueError(f"Invalid evaluation mode. Expected \"exact\" " +
+                f"or \"simulate\", got \"{mode}\".")
+
+        model = self.get_model(params)
+        validate_transmit_strategy(model, f, self.precision)
+        validate_jammer_strategy(model, y, self.precision)
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(EvaluationRequest(model, f, y, mode, future))
+        return await future
+
+    def get_model(self, params: Parameters):
+        """
+        Returns a (warm) model for `params`, keeping the most recently used
+        MODEL_CACHE_SIZE models.
+        """
+        key = get_parameters_key(params)
+        if key in self.models:
+            self.models.move_to_end(key)
+        else:
+            self.models[key] = Model(params)
+            if len(self.models) > MODEL_CACHE_SIZE:
+                self.models.popitem(last = False)
+
+        return self.models[key]
+
+    async def process_requests(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+
+            # Give compatible requests a moment to arrive
+            await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            groups = {}
+            for request in batch:
+                if request.mode == "exact":
+                    key = ("exact", request.params.k, request.params.n,
+                        request.params.m)
+                else:
+                    key = ("simulate", get_parameters_key(request.params))
+                groups.setdefault(key, []).append(request)
+
+            for key, group in groups.items():
+                self.metrics.record_batch(group)
+                evaluate = (self.evaluate_exact if key[0] == "exact"
+                    else self.evaluate_simulated)
+
+                try:
+                    results = await loop.run_in_executor(None, evaluate,
+                        group)
+                except Exception as e:
+                    for request in group:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    continue
+
+                for request, result in zip(group, results):
+                    if not request.future.done():
+                        request.future.set_result(result)
+
+    def evaluate_exact(self, batch: 'list[EvaluationRequest]'):
+        models = [request.model for request in batch]
+        strategies = [convert_strategies_to_arrays(model, request.f,
+            request.y) for model, request in zip(models, batch)]
+
+        v1, v2 = evaluate_values(
+            np.array([model.reward_tensor for model in models]),
+            np.array([model.transition_tensor for model in models]),
+            np.array([f for f, _ in strategies]),
+            np.array([y for _, y in strategies]))
+
+        return [float(value) for value in np.sum(v1 + v2, axis = -1)]
+
+    def evaluate_simulated(self, batch: 'list[EvaluationRequest]'):
+        model = batch[0].model
+        simulation = MultiLinkSimulation([request.f for request in batch],
+            [request.y for request in batch for _ in range(self.games)], 
+            model, precision = self.precision, shared_jammer = False, 
+            copies = self.games)
+
+        rewards, successes = simulation.run()
+        rewards = rewards.reshape(len(batch), self.games).mean(axis = 1)
+        successes = successes.reshape(len(batch), self.games).mean(axis = 1)
+
+        return [(float(reward), float(success))
+            for reward, success in zip(rewards, successes)]
+
+def get_parameters_key(params: Parameters):
+    """
+    A hashable version of Parameters.convert_to_tuple().
+    """
+    return tuple(tuple(p) if isinstance(p, list) else p
+        for p in params.convert_to_tuple())
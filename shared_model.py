@@ -0,0 +1,111 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+from model import Model
+from parameters import Parameters
+
+# The numeric tables of a model that are published to shared memory
+SHARED_TABLES = ["transition_tensor", "reward_components", "reward_tensor"]
+
+# Models that this process has attached to, keyed by their handle
+attached_models = {}
+
+class SharedModelHandle:
+    """
+    A small, picklable description of a model whose tables have been
+    published to shared memory. Pass this to worker processes instead of the
+    model, and call `attach_model` there.
+    """
+    def __init__(self, params: Parameters, tables: dict):
+        self.params = params.convert_to_tuple()
+        self.tables = tables
+
+    def get_key(self):
+        return tuple(sorted(name for name, _, _ in self.tables.values()))
+
+class SharedModel:
+    def __init__(self, model: Model):
+        """
+        Publishes the numeric tables of `model` to shared memory, where they
+        remain until `close` is called (or the `with` block ends).
+
+        Usage:
+            with SharedModel(model) as shared:
+                pool.map(task, [(shared.handle, ...) for ...])
+        """
+        self.model = model
+        self.segments = []
+        tables = {}
+
+        for name in SHARED_TABLES:
+            array = np.ascontiguousarray(getattr(model, name))
+            segment = shared_memory.SharedMemory(create = True,
+                size = max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype,
+                buffer = segment.buf)[...] = array
+
+            self.segments.append(segment)
+            tables[name] = (segment.name, array.shape, array.dtype.str)
+
+        self.handle = SharedModelHandle(model.params, tables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+
+def attach_model(handle: SharedModelHandle):
+    """
+    Returns a model whose numeric tables (and reward matrices) are read-only,
+    zero-copy views of those published with `handle`. Each process only 
+    attaches once per handle, until `detach_model` is called.
+    
+    The objective function (objective_function and MemoryFunctions, through
+    get_transition_matrix) and the vectorized solvers (evaluate_values and
+    evaluate_gradient) only read these tables. Any other table (such as the 
+    nested dicts of transition probabilities) is still calculated, in this 
+    process, on first access.
+    """
+    key = handle.get_key()
+    if key in attached_models:
+        return attached_models[key]
+
+    model = Model(Parameters.get_from_tuple(handle.params))
+    model.shared_segments = []
+
+    for name, (segment_name, shape, dtype) in handle.tables.items():
+        segment = shared_memory.SharedMemory(name = segment_name)
+        array = np.ndarray(shape, dtype, buffer = segment.buf)
+        array.flags.writeable = False
+
+        model.shared_segments.append(segment)
+        model.tables[name] = array
+
+    model.tables["reward_matrices"] = {state: model.reward_tensor[i]
+        for i, state in enumerate(model.state_space)}
+
+    attached_models[key] = model
+    return model
+
+def detach_model(handle: SharedModelHandle):
+    """
+    Closes this process's view of the tables published with `handle` (if it
+    is attached). The model returned by `attach_model` must not be used 
+    afterwards, and no views of its tables may be kept.
+    """
+    model = attached_models.pop(handle.get_key(), None)
+    if model is None:
+        return
+
+    # The views must be released before their segments can be closed
+    model.tables.clear()
+    for segment in model.shared_segments:
+        segment.close()
+    model.shared_segments = []
@@ -1,11 +1,31 @@
 import random, math
+from itertools import accumulate
+from collections import Counter
+from statistics import mean, stdev
 
-from parameters import Parameters
+import numpy as np
+from parameters import Parameters, validate_param
 from model import Model, validate_jammer_strategy, validate_transmit_strategy
 
 class Simulation:
     def __init__(self, f: dict, y: 'list[float]', model: Model, 
-            initial_state: str = "j", precision: int = -1, debug: bool = False):
+            initial_state: str = "j", precision: int = -1, debug: bool = False,
+            control_variate: bool = False, tilted_y: 'list[float]' = None,
+            sweep_tilt: float = None):
+        """
+        If `control_variate` is True, the simulation also records the 
+        expected reward r(x, a1, a2) of each (state, action, jammer power) 
+        tuple it visits, which `estimate_mean_reward` uses to reduce the 
+        variance of the estimated mean reward.
+
+        For importance sampling (see `estimate_tail_probabilities`), the 
+        jammer's power can be drawn from `tilted_y` instead of `y`, and 
+        each channel position in the jammer's sweep can be drawn so that it
+        lands in the block being jammed with probability `sweep_tilt`. The 
+        simulation keeps the log of the likelihood ratio of the game so far
+        (under y and the uniform sweep, over the tilted distributions) in 
+        `log_likelihood_ratio`.
+        """
 
         self.model = model
         params = model.params
@@ -18,6 +38,58 @@ class Simulation:
         self.f = f
         self.y = y
         self.initial_state = initial_state
+        self.control_variate = control_variate
+
+        # Seeded from `random`, so that random.seed still makes simulations
+        # reproducible
+        self.rng = np.random.default_rng(random.getrandbits(64))
+
+        self.power_indices = [i for i in range(len(y))]
+        self.power_cum_weights = list(accumulate(y))
+
+        # Computed once, so (as for the control variate's expected rewards)
+        # f must not change while the simulation is in use
+        self.action_cum_weights = {
+            state: list(accumulate([f[state][action] 
+                for action in model.action_space]))
+            for state in model.state_space
+        }
+
+        validate_param("simulation", "control variate with importance " + 
+            "sampling", False, control_variate and (tilted_y is not None 
+            or sweep_tilt is not None))
+
+        self.tilted_y = tilted_y
+        if tilted_y is not None:
+            validate_tilted_jammer_strategy(y, tilted_y)
+            self.power_cum_weights = list(accumulate(tilted_y))
+            self.power_log_ratios = [math.log(p / q) if p > 0 else -math.inf
+                for p, q in zip(y, tilted_y)]
+
+        if sweep_tilt is not None:
+            validate_param("simulation", "0 < sweep_tilt < 1", True, 
+                0 < sweep_tilt < 1)
+        self.sweep_tilt = sweep_tilt
+
+        # When set, the PN sequence is drawn in chunks of this size instead of
+        # all at once (see `stream`)
+        self.pn_chunk_size = None
+
+        if control_variate:
+            # Expected reward of each (state, action) over the jammer's power,
+            # and of each state over both the action and the jammer's power
+            self.mean_action_rewards = {
+                state: {
+                    action: np.dot(model.transmitter_rewards[state][action], y)
+                    for action in model.action_space
+                } for state in model.state_space
+            }
+            self.mean_state_rewards = {
+                state: sum([f[state][action] 
+                    * self.mean_action_rewards[state][action] 
+                    for action in model.action_space])
+                for state in model.state_space
+            }
 
         self.reset()
 
@@ -26,6 +98,19 @@ class Simulation:
         self.total_tx_reward = 0
         self.message_success_count = 0
 
+        # Used to recompute the reward for other hopping and jamming costs
+        self.total_rate_reward = 0
+        self.hop_count = 0
+
+        # The (state, action) decision that produced the current channel and
+        # rate; the first turn behaves like staying at the highest rate.
+        self.decision = (self.initial_state, "s" + str(len(self.params.rates) 
+            - 1))
+        self.decision_was_drawn = False
+        self.total_expected_tx_reward = 0
+        self.total_mean_tx_reward = 0
+        self.log_likelihood_ratio = 0
+
         self.reset_pn_sequence()
         self.reset_jam_sequence()
 
@@ -36,44 +121,128 @@ class Simulation:
         
     def reset_pn_sequence(self):
         self.current_pn_index = 0
-        self.pn_sequence = [random.randint(0, self.params.k - 1)
-            for _ in range(self.params.t)]
+        self.pn_sequence = self.rng.integers(0, self.params.k, 
+            self.pn_chunk_size or self.params.t).tolist()
 
     def reset_jam_sequence(self):
+        """
+        Start a new sweep of the channels, n at a time, in a random order. 
+        
+        The order is a random permutation that is only generated as far as it
+        is needed: the position of a channel is drawn (from the positions 
+        not yet taken) the first time that channel is checked. A channel is
+        jammed when its position // n is the current jam index, so resetting
+        and checking both take O(1) time regardless of k and n.
+        """
         self.current_jam_index = 0
-        self.jam_sequence = self.get_sweep_sequence()
-        self.current_jammed_channels = self.jam_sequence[0]
+        self.jam_block_count = math.ceil(self.params.k / self.params.n)
+        self.jam_positions = {}
+        self.swapped_jam_positions = {}
+
+        # The channel of a single-channel attack, or None while sweeping
+        self.single_jammed_channel = None
+
+    def get_jam_position(self, channel: int):
+        """
+        Returns the position of `channel` in the jammer's sweep, drawing it 
+        with a sparse Fisher-Yates shuffle if it has not been drawn yet.
+        """
+        try:
+            return self.jam_positions[channel]
+        except KeyError:
+            pass
+
+        drawn = len(self.jam_positions)
+        if self.sweep_tilt is None:
+            swap = drawn + int(random.random() * (self.params.k - drawn))
+        else:
+            swap = self.draw_tilted_jam_swap(drawn)
+        position = self.swapped_jam_positions.get(swap, swap)
+        self.swapped_jam_positions[swap] = self.swapped_jam_positions.pop(
+            drawn, drawn)
+
+        self.jam_positions[channel] = position
+        return position
+
+    def draw_tilted_jam_swap(self, drawn: int):
+        """
+        Draws the index that get_jam_position swaps with, so that the new 
+        position is in the block being jammed with probability sweep_tilt 
+        (uniformly among the positions left in and out of that block), and
+        updates the likelihood ratio. Takes O(k) time.
+        """
+        remaining = range(drawn, self.params.k)
+        in_block = [swap for swap in remaining if self.swapped_jam_positions
+            .get(swap, swap) // self.params.n == self.current_jam_index]
+        out_block = [swap for swap in remaining if self.swapped_jam_positions
+            .get(swap, swap) // self.params.n != self.current_jam_index]
+
+        if not in_block or not out_block:
+            return drawn + int(random.random() * len(remaining))
+
+        if random.random() < self.sweep_tilt:
+            self.log_likelihood_ratio += math.log(len(in_block) 
+                / len(remaining) / self.sweep_tilt)
+            return random.choice(in_block)
+
+        self.log_likelihood_ratio += math.log(len(out_block) 
+            / len(remaining) / (1 - self.sweep_tilt))
+        return random.choice(out_block)
+
+    def channel_is_jammed(self, channel: int):
+        if self.single_jammed_channel is not None:
+            return channel == self.single_jammed_channel
+        return (self.get_jam_position(channel) // self.params.n 
+            == self.current_jam_index)
+
+    def get_jammed_channels(self):
+        """
+        Returns the channels that the jammer is currently on. This draws the
+        position of every channel, so it takes O(k) time and is only used for
+        debugging.
+        """
+        return [channel for channel in range(self.params.k) 
+            if self.channel_is_jammed(channel)]
 
     def get_next_pn_channel(self):
         self.current_pn_index += 1
         if self.current_pn_index >= len(self.pn_sequence):
-            self.current_pn_index = 0
+            if self.pn_chunk_size:
+                # Continue with a new chunk rather than repeating this one
+                self.reset_pn_sequence()
+            else:
+                self.current_pn_index = 0
         return self.pn_sequence[self.current_pn_index]
 
-    def get_sweep_sequence(self):
-        random_channel_sequence = [i for i in range(self.params.k)]
-        random.shuffle(random_channel_sequence)
-
-        n = self.params.n
-
-        return [[random_channel_sequence[i * n + j] for j in range(
-            min(n, len(random_channel_sequence) - i * n)
-        )]
-            for i in range(math.ceil(self.params.k / n))]
-
     def play_turn(self):
+        """
+        Play a single turn of the game, and return whether the transmitter's
+        message was jammed.
+        """
 
         # Send/receive a message
         pn_index = self.current_pn_index
         channel = self.current_tx_channel
         rate_index = self.current_tx_rate_index
-        jammer_power_index = random.choices([i for i in range(len(self.y))], 
-            self.y)[0]
+        jammer_power_index = random.choices(self.power_indices, 
+            cum_weights = self.power_cum_weights)[0]
+        if self.tilted_y is not None:
+            self.log_likelihood_ratio += self.power_log_ratios[
+                jammer_power_index]
         jam_index = self.current_jam_index
-        jammed_channels = self.current_jammed_channels
+        jammed_channels = self.get_jammed_channels() if self.debug else None
+        jammer_on_channel = self.channel_is_jammed(channel)
         single_jam = self.jam_single_channel
 
-        message_was_jammed = (channel in jammed_channels and 
+        if self.control_variate:
+            state, action = self.decision
+            self.total_expected_tx_reward += self.model.transmitter_rewards \
+                [state][action][jammer_power_index]
+            self.total_mean_tx_reward += (
+                self.mean_state_rewards[state] if self.decision_was_drawn
+                else self.mean_action_rewards[state][action])
+
+        message_was_jammed = (jammer_on_channel and 
             jammer_power_index > self.params.m - rate_index) or (single_jam and 
                 self.params.get_single_channel_attack_sinr(jammer_power_index) 
                 <= self.params.sinr_limits[rate_index]
@@ -84,10 +253,11 @@ class Simulation:
             self.total_tx_reward -= self.params.l
         else:
             self.total_tx_reward += self.params.rates[rate_index]
+            self.total_rate_reward += self.params.rates[rate_index]
             self.message_success_count += 1
 
         # Determine whether the jammer overheard an ACK or NACK
-        jammer_overheard_something = channel in jammed_channels
+        jammer_overheard_something = jammer_on_channel
         jammer_overheard_ack = (jammer_overheard_something and 
             not message_was_jammed)
         jammer_overheard_nack = (jammer_overheard_something and 
@@ -108,9 +278,10 @@ class Simulation:
                 self.state = str(int(self.state) + 1)
         
         # Choose the next action
-        action_p_dict = self.f[self.state]
-        tx_action = random.choices(self.model.action_space, [action_p_dict[k] 
-            for k in action_p_dict])[0]
+        tx_action = random.choices(self.model.action_space, 
+            cum_weights = self.action_cum_weights[self.state])[0]
+        self.decision = (self.state, tx_action)
+        self.decision_was_drawn = True
         
         if tx_action[0] == "s":
             # Stay
@@ -120,6 +291,7 @@ class Simulation:
             self.state = "j"
             self.current_tx_channel = self.get_next_pn_channel()
             self.total_tx_reward -= self.params.c
+            self.hop_count += 1
 
         new_rate_index = int(tx_action[1:])
         self.current_tx_rate_index = new_rate_index
@@ -129,13 +301,12 @@ class Simulation:
             self.jam_single_channel = False
         elif jammer_overheard_ack:
             self.jam_single_channel = True
-            self.current_jammed_channels = [channel]
+            self.single_jammed_channel = channel
         else:
             self.current_jam_index += 1
-            if self.current_jam_index >= len(self.jam_sequence):
+            if self.current_jam_index >= self.jam_block_count:
                 self.current_jam_index = 0
-            self.current_jammed_channels = \
-                self.jam_sequence[self.current_jam_index]
+            self.single_jammed_channel = None
 
         if self.debug:
             info = (f"""### Game turn information ###""" +
@@ -167,6 +338,7 @@ class Simulation:
             print(info)
             input()
 
+        return message_was_jammed
 
     def run(self):
         """
@@ -181,6 +353,214 @@ class Simulation:
 
         reward = self.total_tx_reward
         successes = self.message_success_count
+
+        if self.control_variate:
+            self.last_reward_control = (self.total_expected_tx_reward 
+                - self.total_mean_tx_reward) / self.params.t
+
         self.reset() 
 
-        return reward / self.params.t, successes / self.params.t
\ No newline at end of file
+        return reward / self.params.t, successes / self.params.t
+
+    def stream(self, turns: int = None, window: int = 10000, 
+            chunk_size: int = 65536):
+        """
+        Play a single game of `turns` turns (or indefinitely, if None) and 
+        yield statistics for every `window` turns as they are played. The PN
+        sequence is drawn `chunk_size` channels at a time, so memory stays 
+        bounded however long the game is (params.t is not used, and can be
+        left small). Each window yields a dict with:
+         - "start": the turn at which the window started
+         - "turns": the number of turns in the window
+         - "reward": the transmitter reward per unit time
+         - "success": the percent success
+         - "jam_streaks": a Counter of the lengths of the streaks of 
+                consecutive jammed turns that ended in the window
+         - "longest_jam_streak": the longest streak of jammed turns seen in
+                the window (including one still in progress)
+        Resets the simulation to the original state after the game (or when
+        the generator is closed).
+        """
+        self.pn_chunk_size = chunk_size
+        self.reset()
+
+        game_time = 0
+        jam_streak = 0
+
+        try:
+            while turns is None or game_time < turns:
+                window_turns = (window if turns is None 
+                    else min(window, turns - game_time))
+                start_reward = self.total_tx_reward
+                start_successes = self.message_success_count
+                jam_streaks = Counter()
+                longest_jam_streak = 0
+
+                for _ in range(window_turns):
+                    if self.play_turn():
+                        jam_streak += 1
+                    elif jam_streak > 0:
+                        jam_streaks[jam_streak] += 1
+                        longest_jam_streak = max(longest_jam_streak, 
+                            jam_streak)
+                        jam_streak = 0
+
+                yield {
+                    "start": game_time,
+                    "turns": window_turns,
+                    "reward": (self.total_tx_reward - start_reward) 
+                        / window_turns,
+                    "success": (self.message_success_count 
+                        - start_successes) / window_turns,
+                    "jam_streaks": jam_streaks,
+                    "longest_jam_streak": max(longest_jam_streak, jam_streak)
+                }
+
+                game_time += window_turns
+        finally:
+            self.pn_chunk_size = None
+            self.reset()
+
+    def run_cost_grid(self, c_values: 'list[float]', 
+            l_values: 'list[float]'):
+        """
+        Play a game of the specified length and return (1) the transmitter 
+        reward per unit time for every hopping cost in `c_values` and jamming
+        cost in `l_values`, as an array indexed by [c, l], and (2) the percent
+        success. The costs do not affect how the game is played, so a single 
+        game is enough for the whole grid.
+        Resets the simulation to the original state after run is complete.
+        """
+        game_time = 0
+        while game_time < self.params.t:
+            self.play_turn()
+            game_time += 1
+
+        jam_count = self.params.t - self.message_success_count
+        c_values = np.asarray(c_values, dtype = float)[:, np.newaxis]
+        l_values = np.asarray(l_values, dtype = float)
+        rewards = (self.total_rate_reward - c_values * self.hop_count 
+            - l_values * jam_count)
+        successes = self.message_success_count
+        self.reset()
+
+        return rewards / self.params.t, successes / self.params.t
+
+    def estimate_mean_reward(self, games: int = 2000):
+        """
+        Play `games` games and return (1) an estimate of the mean reward per 
+        unit time and (2) its standard error. 
+        
+        With `control_variate` enabled, each game's sum of r(x, a1, a2) over 
+        the visited tuples, minus the sum of its expectation over the 
+        transmitter's action and the jammer's power at each visited state, 
+        is used as a control variate. Both are drawn from f and y given the
+        state, so this control has a mean of exactly 0 even where the model's
+        transition probabilities differ from the simulation. Otherwise, this 
+        is the plain sample mean.
+        """
+        rewards = []
+        controls = []
+
+        for _ in range(games):
+            reward, _ = self.run()
+            rewards.append(reward)
+            if self.control_variate:
+                controls.append(self.last_reward_control)
+
+        if not self.control_variate:
+            return mean(rewards), stdev(rewards) / math.sqrt(games)
+
+        return control_variate_estimate(rewards, controls)
+
+    def estimate_tail_probabilities(self, games: int = 2000, 
+            streak_length: int = None, success_threshold: float = None):
+        """
+        Play `games` games and return estimates of the probability that a 
+        game has a streak of more than `streak_length` consecutive jammed 
+        turns ("jam_streak"), and that its percent success is below 
+        `success_threshold` ("low_success"), as a dict mapping each event 
+        that was asked for to (1) the estimate and (2) its standard error.
+
+        Each game is weighted by its likelihood ratio, so the estimates are
+        unbiased whether or not the simulation uses importance sampling 
+        (tilted_y or sweep_tilt). Tilting toward jamming makes these events
+        common, so far fewer games are needed than with plain sampling.
+        """
+        validate_param("tail probability estimate", "an event", True, 
+            streak_length is not None or success_threshold is not None)
+
+        values = {}
+        if streak_length is not None:
+            values["jam_streak"] = []
+        if success_threshold is not None:
+            values["low_success"] = []
+
+        for _ in range(games):
+            streak = 0
+            longest_streak = 0
+            for _ in range(self.params.t):
+                if self.play_turn():
+                    streak += 1
+                    longest_streak = max(longest_streak, streak)
+                else:
+                    streak = 0
+
+            weight = math.exp(self.log_likelihood_ratio)
+            success = self.message_success_count / self.params.t
+            self.reset()
+
+            if streak_length is not None:
+                values["jam_streak"].append(weight * (longest_streak 
+                    > streak_length))
+            if success_threshold is not None:
+                values["low_success"].append(weight * (success 
+                    < success_threshold))
+
+        return {event: (mean(weighted), stdev(weighted) / math.sqrt(games))
+            for event, weighted in values.items()}
+
+def tilt_jammer_strategy(y: 'list[float]', tilt: float):
+    """
+    Returns the jammer strategy y exponentially tilted toward higher power:
+    y[i] * exp(tilt * i), normalized. The result may not satisfy the power
+    constraint, and is meant for importance sampling (see Simulation).
+    """
+    weights = [p * math.exp(tilt * i) for i, p in enumerate(y)]
+    return [w / sum(weights) for w in weights]
+
+def validate_tilted_jammer_strategy(y: 'list[float]', 
+        tilted_y: 'list[float]'):
+    """
+    Ensures that `tilted_y` is a distribution over the same power indices as
+    y that can draw every power index that y can, and throws a ValueError
+    otherwise.
+    """
+    validate_param("tilted jammer strategy", "number of elements", len(y),
+        len(tilted_y))
+    validate_param("tilted jammer strategy", "sum of elements", 1, 
+        round(sum(tilted_y), 9))
+    for i, (p, q) in enumerate(zip(y, tilted_y)):
+        if q < 0 or (p > 0 and q == 0):
+            validate_param("tilted jammer strategy", 
+                f"tilted_y[{i}] > 0 where y[{i}] > 0", True, False)
+
+def control_variate_estimate(values: 'list[float]', 
+        controls: 'list[float]'):
+    """
+    Returns the control variate estimate of the mean of `values` and its 
+    standard error, using `controls` (which must have a known mean of 0) 
+    with the variance-minimizing coefficient.
+    """
+    count = len(values)
+    value_mean = mean(values)
+    control_mean = mean(controls)
+
+    control_variance = sum([(c - control_mean) ** 2 for c in controls])
+    covariance = sum([(v - value_mean) * (c - control_mean) 
+        for v, c in zip(values, controls)])
+    beta = covariance / control_variance if control_variance > 0 else 0
+
+    adjusted = [v - beta * c for v, c in zip(values, controls)]
+
+    return mean(adjusted), stdev(adjusted) / math.sqrt(count)
\ No newline at end of file
@@ -0,0 +1,285 @@
+import argparse, os, pickle, socket, sqlite3, time, traceback
+from threading import Event, Thread
+
+from parameters import Parameters
+
+LEASE_TIME = 600 # Seconds a worker may hold a point without renewing it
+MAX_ATTEMPTS = 3 # Times a point is tried before it is marked as failed
+POLL_INTERVAL = 5 # Seconds an idle worker waits before checking again
+
+class SweepQueue:
+    def __init__(self, path: str, lease_time: float = LEASE_TIME):
+        """
+        A queue of parameter points kept in a SQLite database at `path`,
+        which any number of worker processes (on any machine that can reach
+        the file) can claim points from. A claimed point is leased to its
+        worker for `lease_time` seconds; the worker renews the lease while
+        it works, and a point whose lease expires (because its worker
+        crashed or was preempted) is given to the next worker that asks.
+        An expired lease counts as a failed attempt, so a point that keeps
+        crashing its workers is marked as failed after MAX_ATTEMPTS.
+
+        SQLite relies on file locking, so the shared storage must support
+        it (as most NFS setups do with locking enabled).
+        """
+        self.path = path
+        self.lease_time = lease_time
+
+        with self.connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS points (
+                    id INTEGER PRIMARY KEY,
+                    params BLOB NOT NULL,
+                    settings BLOB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result BLOB,
+                    error TEXT
+                )""")
+
+    def connect(self):
+        # Transactions are started explicitly, so that a claim can lock the
+        # database before reading it
+        connection = sqlite3.connect(self.path, timeout = 60,
+            isolation_level = None)
+        return ClosingConnection(connection)
+
+    def enqueue(self, points: 'list[Parameters]', method: str = "slsqp",
+            games: int = 2000):
+        """
+        Adds a point for each of the Parameters in `points`, to be evaluated
+        with the given solver method and number of simulated games. Returns
+        the ids of the new points.
+        """
+        settings = pickle.dumps({"method": method, "games": games})
+
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            ids = [connection.execute(
+                "INSERT INTO points (params, settings) VALUES (?, ?)",
+                (pickle.dumps(params.convert_to_tuple()), settings)
+            ).lastrowid for params in points]
+            connection.execute("COMMIT")
+
+        return ids
+
+    def claim(self, worker: str):
+        """
+        Leases the next pending (or expired) point to `worker`. Returns
+        (id, Parameters, settings), or None if no point is available.
+        """
+        now = time.time()
+
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            expire_leases(connection, now)
+            row = connection.execute("""
+                SELECT id, params, settings FROM points
+                WHERE status = 'pending'
+                ORDER BY id LIMIT 1""").fetchone()
+
+            if row is not None:
+                connection.execute("""
+                    UPDATE points SET status = 'leased', worker = ?,
+                        lease_expires = ?, attempts = attempts + 1
+                    WHERE id = ?""", (worker, now + self.lease_time, row[0]))
+            connection.execute("COMMIT")
+
+        if row is None:
+            return None
+
+        return (row[0], Parameters.get_from_tuple(pickle.loads(row[1])),
+            pickle.loads(row[2]))
+
+    def renew(self, point_id: int, worker: str):
+        """
+        Extends the lease of `worker` on a point. Returns False if the lease
+        has been lost (it expired and the point was claimed by another
+        worker).
+        """
+        return self.update_leased(point_id, worker,
+            "lease_expires = ?", (time.time() + self.lease_time,))
+
+    def complete(self, point_id: int, worker: str, result):
+        """
+        Records the result of a point. Returns False (and discards the
+        result) if `worker` no longer holds the lease on the point.
+        """
+        return self.update_leased(point_id, worker,
+            "status = 'done', lease_expires = NULL, result = ?",
+            (pickle.dumps(result),))
+
+    def fail(self, point_id: int, worker: str, error: str):
+        """
+        Returns a point whose evaluation raised an exception to the queue,
+        or marks it as failed after MAX_ATTEMPTS attempts.
+        """
+        return self.update_leased(point_id, worker, """
+            status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            lease_expires = NULL, error = ?""", (MAX_ATTEMPTS, error))
+
+    def update_leased(self, point_id: int, worker: str, assignments: str,
+            values: tuple):
+        with self.connect() as connection:
+            cursor = connection.execute(f"""
+                UPDATE points SET {assignments}
+                WHERE id = ? AND worker = ? AND status = 'leased'""",
+                values + (point_id, worker))
+            return cursor.rowcount == 1
+
+    def reclaim_expired(self):
+        """
+        Returns every point with an expired lease to the queue (or marks it
+        as failed after MAX_ATTEMPTS attempts), and returns how many there 
+        were. (Claiming does the same, so this only makes the status counts
+        accurate.)
+        """
+        with self.connect() as connection:
+            return expire_leases(connection, time.time())
+
+    def get_status(self):
+        """
+        Returns the number of points with each status.
+        """
+        with self.connect() as connection:
+            return dict(connection.execute(
+                "SELECT status, COUNT(*) FROM points GROUP BY status"))
+
+    def get_results(self):
+        """
+        Returns (Parameters, settings, result) for every completed point,
+        in the order that they were enqueued.
+        """
+        with self.connect() as connection:
+            rows = connection.execute("""
+                SELECT params, settings, result FROM points
+                WHERE status = 'done' ORDER BY id""").fetchall()
+
+        return [(Parameters.get_from_tuple(pickle.loads(params)),
+            pickle.loads(settings), pickle.loads(result))
+            for params, settings, result in rows]
+
+def expire_leases(connection: sqlite3.Connection, now: float):
+    """
+    Treats every lease that expired before `now` as a failed attempt (see
+    SweepQueue.fail), and returns how many there were.
+    """
+    return connection.execute("""
+        UPDATE points SET
+            status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            lease_expires = NULL, error = 'Lease expired'
+        WHERE status = 'leased' AND lease_expires < ?""",
+        (MAX_ATTEMPTS, now)).rowcount
+
+class ClosingConnection:
+    """
+    Closes a SQLite connection at the end of a `with` block (which sqlite3
+    connections do not do by themselves).
+    """
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *_):
+        self.connection.close()
+
+def get_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def run_worker(path: str, worker: str = None, max_points: int = None,
+        lease_time: float = LEASE_TIME, poll_interval: float = POLL_INTERVAL):
+    """
+    Claims and evaluates points from the queue at `path` until there are no
+    points left that are pending or leased (or `max_points` have been
+    evaluated), renewing each lease in the background while the point is
+    evaluated. Returns the number of points evaluated.
+    """
+    from analysis import evaluate_point
+
+    queue = SweepQueue(path, lease_time)
+    worker = get_worker_name() if worker is None else worker
+    evaluated = 0
+
+    while max_points is None or evaluated < max_points:
+        claimed = queue.claim(worker)
+
+        if claimed is None:
+            if queue.get_status().get("leased", 0) == 0:
+                break
+
+            # Other workers still hold points, whose leases may yet expire
+            time.sleep(poll_interval)
+            continue
+
+        point_id, params, settings = claimed
+        done = Event()
+        heartbeat = Thread(target = renew_lease,
+            args = (queue, point_id, worker, done), daemon = True)
+        heartbeat.start()
+
+        try:
+            result = evaluate_point(params, settings["games"],
+                settings["method"])
+        except Exception:
+            done.set()
+            heartbeat.join()
+            queue.fail(point_id, worker, traceback.format_exc())
+            continue
+
+        done.set()
+        heartbeat.join()
+        queue.complete(point_id, worker, result)
+        evaluated += 1
+
+    return evaluated
+
+def renew_lease(queue: SweepQueue, point_id: int, worker: str, done: Event):
+    while not done.wait(queue.lease_time / 3):
+        if not queue.renew(point_id, worker):
+            return
+
+def enqueue_figures_2_and_3(path: str, k_values: 'list[int]',
+        method: str = "slsqp", games: int = 2000):
+    """
+    Enqueues the points of analysis.figures_2_and_3 for every k in
+    `k_values`.
+    """
+    from analysis import get_figure_parameters
+
+    _, variants = get_figure_parameters()
+    return SweepQueue(path).enqueue([Parameters(rates = rates, k = k,
+        m = len(rates) - 1) for rates in variants for k in k_values],
+        method, games)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run a parameter sweep " +
+        "from a queue shared by any number of workers.")
+    parser.add_argument("command", choices = ["enqueue", "worker", "status"])
+    parser.add_argument("database")
+    parser.add_argument("--k", type = int, nargs = "+", default = [3],
+        help = "values of k to enqueue (figures 2 and 3)")
+    parser.add_argument("--method", default = "slsqp")
+    parser.add_argument("--games", type = int, default = 2000)
+    parser.add_argument("--max-points", type = int)
+    parser.add_argument("--lease-time", type = float, default = LEASE_TIME)
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        ids = enqueue_figures_2_and_3(args.database, args.k, args.method,
+            args.games)
+        print(f"Enqueued {len(ids)} points")
+    elif args.command == "worker":
+        count = run_worker(args.database, max_points = args.max_points,
+            lease_time = args.lease_time)
+        print(f"Evaluated {count} points")
+    else:
+        queue = SweepQueue(args.database)
+        queue.reclaim_expired()
+        print(queue.get_status())
+
+if __name__ == "__main__":
+    main()
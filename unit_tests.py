@@ -1,12 +1,32 @@
+import model as model_module
 from markov import QTable
-from simulation import Simulation
+from simulation import Simulation, tilt_jammer_strategy
+from multilink import MultiLinkSimulation
+from service import EvaluationService
+from shared_model import SharedModel, SharedModelHandle, attach_model, \
+    detach_model
 from parameters import Parameters
-from optimize import convert_strategies_to_list, convert_list_to_strategies
-from model import Model, validate_transmit_strategy, validate_jammer_strategy
+from optimize import convert_strategies_to_list, convert_list_to_strategies, \
+    convert_strategies_to_arrays, evaluate_cost_grid, evaluate_horizons, \
+    objective_function, optimize_game, sweep_horizons, MemoryFunctions, \
+    create_random_strategies, find_equilibria
+from sensitivity import equilibrium_sensitivity, perturb_parameter
+from sweep import SweepQueue, MAX_ATTEMPTS
+from lookup import build_strategy_index, StrategyIndex
+from jammers import run_tournament, JAMMER_MODELS
+from controller import TransmitterController, benchmark_controller
+from refine import refine_sweep
+from model import Model, LumpedModel, validate_transmit_strategy, \
+    validate_jammer_strategy, validate_transmit_strategies, \
+    validate_jammer_strategies, project_jammer_strategy
 
 from tqdm import tqdm
 import matplotlib.pyplot as plt
+import numpy as np
 from statistics import stdev, median, mean
+from collections import Counter
+import subprocess, sys, asyncio, time, os, pickle, tempfile, random
+from multiprocessing import Pool
 
 def test_create_parameters():
 
@@ -160,6 +180,705 @@ def test_random_strategies():
     sim = Simulation(qtable, y, model)
     print(sim.run())
 
+def test_control_variate():
+
+    params = Parameters()
+    model = Model(params)
+
+    qtable = QTable(model)
+    qtable.epsilon = 1
+    y = [1 / (params.m + 1) for _ in range(params.m + 1)]
+
+    sim = Simulation(qtable, y, model, control_variate = True)
+    cv_mean, cv_error = sim.estimate_mean_reward(games = 200)
+
+    sim.control_variate = False
+    plain_mean, plain_error = sim.estimate_mean_reward(games = 200)
+
+    print(f"Control variate estimate: {round(cv_mean, 4)} " + 
+          f"(standard error {round(cv_error, 4)})")
+    print(f"Plain estimate: {round(plain_mean, 4)} " + 
+          f"(standard error {round(plain_error, 4)})")
+
+def test_importance_sampling():
+
+    params = Parameters(t = 20)
+    model = Model(params)
+    f = create_demo_transmit_strategy(model)
+    y = [1 / (params.m + 1) for _ in range(params.m + 1)]
+
+    plain = Simulation(f, y, model)
+    tilted = Simulation(f, y, model, tilted_y = tilt_jammer_strategy(y, 0.3),
+        sweep_tilt = 0.7)
+
+    for name, sim in [("Plain", plain), ("Importance sampling", tilted)]:
+        estimates = sim.estimate_tail_probabilities(games = 2000, 
+            streak_length = 7, success_threshold = 0.3)
+        for event, (estimate, error) in estimates.items():
+            print(f"{name} estimate of P({event}): {estimate:.3g} " + 
+                  f"(standard error {error:.3g})")
+
+def test_lazy_model():
+
+    model = Model(Parameters(k = 6))
+    print(f"Tables calculated on construction: {list(model.tables)}")
+
+    other_costs = Model(Parameters(k = 6, c = 10, l = 5))
+    shared = (model.transition_probabilities is 
+        other_costs.transition_probabilities)
+    print(f"Transition probabilities shared across costs: {shared}")
+
+    same_params = Model(Parameters(k = 6))
+    shared = model.reward_matrices is same_params.reward_matrices
+    print(f"Reward matrices shared across equal parameters: {shared}")
+
+    assert other_costs.reward_matrices is not model.reward_matrices
+
+    # The cache is bounded by the size of its tables, and a model keeps its
+    # own tables after they are dropped from the cache
+    cache_bytes = model_module.TABLE_CACHE_BYTES
+    model_module.TABLE_CACHE_BYTES = 2 ** 23
+    try:
+        models = [Model(Parameters(k = k)) for k in range(3, 13)]
+        tensors = [model.transition_tensor for model in models]
+        print(f"Cached tables with an 8 MB limit: " + 
+              f"{len(model_module.table_cache)}, using " + 
+              f"{model_module.table_cache_bytes} bytes")
+        assert model_module.table_cache_bytes <= 2 ** 23
+        assert all(model.transition_tensor is tensor 
+            for model, tensor in zip(models, tensors))
+    finally:
+        model_module.TABLE_CACHE_BYTES = cache_bytes
+
+def test_cost_grid():
+
+    params = Parameters()
+    model = Model(params)
+
+    qtable = QTable(model)
+    qtable.epsilon = 1
+    y = [1 / (params.m + 1) for _ in range(params.m + 1)]
+
+    c_values = [0, 25, params.c]
+    l_values = [0, params.l]
+    grid = evaluate_cost_grid(model, qtable, y, c_values, l_values)
+
+    memfunc = MemoryFunctions(model)
+    value = objective_function(convert_strategies_to_list(qtable, y), memfunc)
+    print(f"Objective from cost grid: {grid[2][1]}, " + 
+          f"from objective function: {value}")
+
+    sim = Simulation(qtable, y, model)
+    rewards, success = sim.run_cost_grid(c_values, l_values)
+    print(f"Simulated rewards for cost grid:\n{rewards}\nsuccess {success}")
+
+def test_headless_imports():
+
+    # Run in a new interpreter, since this one has already imported everything
+    code = ("import sys, time; start = time.perf_counter(); " + 
+        "import optimize, simulation; " + 
+        "print(round(time.perf_counter() - start, 3), " + 
+        "[m for m in ('matplotlib', 'scipy', 'tqdm') if m in sys.modules])")
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.run([sys.executable, "-c", code], cwd = directory,
+        env = dict(os.environ, PYTHONPATH = directory), 
+        capture_output = True, text = True)
+    assert process.returncode == 0, process.stderr
+    output = process.stdout.split(" ", 1)
+
+    print(f"Headless import took {output[0]} seconds and loaded " + 
+          f"{output[1].strip()}")
+    assert output[1].strip() == "[]"
+
+def test_multilink_simulation():
+
+    params = Parameters(k = 10)
+    model = Model(params)
+
+    f = create_demo_transmit_strategy(model)
+    y = create_demo_jammer_strategy(model)
+
+    for shared_jammer in [True, False]:
+        sim = MultiLinkSimulation([f for _ in range(20)], y, model, 
+            shared_jammer = shared_jammer)
+        rewards, successes = sim.run()
+        print(f"Shared jammer: {shared_jammer}, " + 
+              f"mean reward {round(rewards.mean(), 4)}, " + 
+              f"mean success {round(successes.mean(), 4)}")
+
+def test_multilink_matches_simulation():
+
+    params = Parameters(k = 10)
+    model = Model(params)
+    games = 500
+
+    # A transmit strategy that mixes staying and hopping in every state
+    rng = np.random.default_rng(0)
+    f = {state: dict(zip(model.action_space, rng.dirichlet(np.ones(
+        len(model.action_space))).tolist())) for state in model.state_space}
+    y = create_demo_jammer_strategy(model)
+
+    random.seed(0)
+    sim = Simulation(f, y, model, precision = 6)
+    rewards = [sim.run()[0] for _ in range(games)]
+
+    multilink = MultiLinkSimulation([f], y, model, precision = 6, 
+        shared_jammer = False, seed = 0, copies = games)
+    multilink_rewards, _ = multilink.run()
+
+    error = np.sqrt(np.var(rewards, ddof = 1) / games 
+        + np.var(multilink_rewards, ddof = 1) / games)
+    print(f"Simulation: mean reward {round(mean(rewards), 4)}, " + 
+          f"MultiLinkSimulation: {round(multilink_rewards.mean(), 4)} " + 
+          f"(standard error of the difference {round(error, 4)})")
+    assert abs(mean(rewards) - multilink_rewards.mean()) < 4 * error
+
+def test_shared_jammer():
+
+    params = Parameters(k = 100)
+    model = Model(params)
+
+    f = create_demo_transmit_strategy(model)
+    y = create_demo_jammer_strategy(model)
+
+    # A single-channel attack only reaches links on the attacked channel
+    sim = MultiLinkSimulation([f for _ in range(3)], y, model, seed = 0)
+    jammer = sim.jammer
+    jammer.jam_single_channel[:] = True
+    jammer.on_single_channel[:] = True
+    jammer.single_jammed_channel[:] = 5
+    on_channel, single_jam = jammer.get_channel_status(np.array([5, 6, 7]))
+    assert list(on_channel) == [True, False, False]
+    assert list(single_jam) == [True, False, False]
+
+    # So links sharing a jammer (on their own channels) are not degraded
+    successes = []
+    for link_count in [1, 50]:
+        sim = MultiLinkSimulation([f for _ in range(link_count)], y, model,
+            contention = False, seed = 0)
+        successes.append(np.mean([sim.run()[1].mean() for _ in range(40)]))
+    print(f"Mean success with a shared jammer: {round(successes[0], 4)} " + 
+          f"for 1 link, {round(successes[1], 4)} for 50 links")
+    assert successes[1] >= successes[0] - 0.01
+
+def test_evaluation_service():
+
+    params = Parameters()
+    model = Model(params)
+
+    f = create_demo_transmit_strategy(model)
+    y = create_demo_jammer_strategy(model)
+    qtable = QTable(model)
+    qtable.epsilon = 1
+
+    async def evaluate_all(service: EvaluationService):
+        requests = [service.evaluate(params, f if i % 2 else qtable, y) 
+            for i in range(20)]
+        requests.append(service.evaluate(params, f, y, mode = "simulate"))
+        return await asyncio.gather(*requests)
+
+    async def run_service():
+        async with EvaluationService(games = 2) as service:
+            results = await evaluate_all(service)
+            return results, service.metrics.summary()
+
+    results, metrics = asyncio.run(run_service())
+
+    memfunc = MemoryFunctions(model)
+    value = objective_function(convert_strategies_to_list(f, y), memfunc)
+    print(f"Service objective: {results[1]}, objective function: {value}")
+    print(f"Service simulation: {results[-1]}")
+    print(f"Service metrics: {metrics}")
+
+    # The simulated mean reward of a mixed stay/hop strategy against the 
+    # same mean from Simulation.run
+    games = 500
+    rng = np.random.default_rng(1)
+    f = {state: dict(zip(model.action_space, rng.dirichlet(np.ones(
+        len(model.action_space))).tolist())) for state in model.state_space}
+
+    async def simulate():
+        async with EvaluationService(games = games, precision = 6) as service:
+            return await service.evaluate(params, f, y, mode = "simulate")
+
+    service_reward, _ = asyncio.run(simulate())
+    random.seed(0)
+    sim = Simulation(f, y, model, precision = 6)
+    rewards = [sim.run()[0] for _ in range(games)]
+
+    # The service only returns means, so both are taken to have the 
+    # variance of Simulation's games
+    error = np.sqrt(2 * np.var(rewards, ddof = 1) / games)
+    print(f"Service simulated reward {round(service_reward, 4)}, " + 
+          f"Simulation {round(mean(rewards), 4)}")
+    assert abs(service_reward - mean(rewards)) < 4 * error
+
+def evaluate_shared_model(handle: SharedModelHandle):
+    model = attach_model(handle)
+    attached_tables = dict(model.tables)
+    qtable = QTable(model)
+    qtable.epsilon = 1
+    y = create_demo_jammer_strategy(model)
+
+    memfunc = MemoryFunctions(model)
+    value = objective_function(convert_strategies_to_list(qtable, y), memfunc)
+
+    # No table should have been calculated (or copied) after attaching
+    return float(value), model.tables == attached_tables
+
+def test_shared_model():
+
+    params = Parameters(k = 6)
+    model = Model(params)
+
+    with SharedModel(model) as shared:
+        with Pool(2) as pool:
+            results = pool.map(evaluate_shared_model, [shared.handle] * 4)
+
+        attached = attach_model(shared.handle)
+        assert not attached.transition_tensor.flags.owndata
+        detach_model(shared.handle)
+        assert attached.shared_segments == []
+        assert attach_model(shared.handle) is not attached
+        detach_model(shared.handle)
+
+    qtable = QTable(model)
+    qtable.epsilon = 1
+    y = create_demo_jammer_strategy(model)
+    memfunc = MemoryFunctions(model)
+    value = objective_function(convert_strategies_to_list(qtable, y), memfunc)
+
+    values = [worker_value for worker_value, _ in results]
+    print(f"Objective from workers using shared memory: {values}, " + 
+          f"locally: {value}")
+    for worker_value, no_tables_calculated in results:
+        assert abs(worker_value - value) < 1e-9
+        assert no_tables_calculated
+
+def test_large_k_simulation():
+
+    params = Parameters(k = 100000, n = 1000, t = 200)
+    model = Model(params)
+
+    f = create_demo_transmit_strategy(model)
+    y = create_demo_jammer_strategy(model)
+
+    sim = Simulation(f, y, model)
+    start_time = time.time()
+    tx_reward, success = sim.run()
+    turn_time = (time.time() - start_time) / params.t
+
+    print(f"k = {params.k}: reward {tx_reward}, success {success}, " + 
+          f"{round(turn_time * 1e6, 2)} microseconds per turn")
+
+def test_stream_simulation():
+
+    params = Parameters()
+    model = Model(params)
+
+    f = create_demo_transmit_strategy(model)
+    y = create_demo_jammer_strategy(model)
+
+    sim = Simulation(f, y, model)
+    for stats in sim.stream(turns = 25000, window = 10000, chunk_size = 1000):
+        print(f"Turns {stats['start']} to " + 
+              f"{stats['start'] + stats['turns']}: " + 
+              f"reward {round(stats['reward'], 4)}, " + 
+              f"success {round(stats['success'], 4)}, " + 
+              f"longest jam streak {stats['longest_jam_streak']}")
+
+def test_sensitivity():
+
+    settings = {"k": 3, "m": 1, "rates": [6, 24]}
+    params = Parameters(**settings)
+    model, f, y = optimize_game(params)
+
+    start = time.perf_counter()
+    sensitivities = equilibrium_sensitivity(model, f, y)
+    elapsed = time.perf_counter() - start
+    print(f"Sensitivities took {round(elapsed, 4)} seconds")
+
+    # Compare with solving the game again either side of each parameter
+    for name, derivatives in sensitivities.items():
+        sensitivity = derivatives["value"]
+        delta = 0.01 * abs(getattr(params, name))
+        values = []
+        for sign in [-1, 1]:
+            perturbed = dict(settings)
+            perturbed[name] = getattr(params, name) + sign * delta
+            model_p, f_p, y_p = optimize_game(Parameters(**perturbed))
+            values.append(objective_function(convert_strategies_to_list(
+                f_p, y_p), MemoryFunctions(model_p)))
+        resolved = (values[1] - values[0]) / (2 * delta)
+
+        print(f"d(value)/d({name}) = {round(sensitivity, 4)}, " + 
+              f"from solving again: {round(resolved, 4)}")
+        # Within the noise of solving again (the strategies are rounded)
+        assert abs(sensitivity - resolved) < 0.02 + 0.05 * abs(resolved)
+
+        # The power constraint is active, so y moves along it as p_jam and
+        # p_avg change (solving again is too noisy to compare with)
+        print(f"d(y)/d({name}) = {np.round(derivatives['y'], 4)}")
+        assert abs(sum(derivatives["y"])) < 1e-9
+        step = 1e-4 * abs(getattr(params, name))
+        moved = perturb_parameter(params, name, step)
+        slack = np.dot(params.p_jam, y) - params.p_avg
+        moved_slack = np.dot(moved.p_jam, np.array(y) 
+            + step * np.array(derivatives["y"])) - moved.p_avg
+        assert abs(moved_slack - slack) < 1e-3 * step
+
+    # Here the objective function is linear along the active constraints,
+    # so only the derivatives of the value are determined
+    model, f, y = optimize_game(Parameters(k = 4, m = 1, rates = [6, 24]))
+    try:
+        equilibrium_sensitivity(model, f, y)
+    except ValueError as e:
+        print(f"Singular reduced Hessian: {e}")
+    else:
+        raise AssertionError("Singular reduced Hessian was not reported")
+    sensitivities = equilibrium_sensitivity(model, f, y, strategies = False)
+    print(f"Value sensitivities for k = 4: {sensitivities}")
+    assert all(derivatives.keys() == {"value"} 
+        for derivatives in sensitivities.values())
+
+def test_sweep_horizons():
+
+    params = Parameters()
+    model = Model(params)
+
+    qtable = QTable(model)
+    qtable.epsilon = 1
+    y = [1 / (params.m + 1) for _ in range(params.m + 1)]
+
+    f_array, y_array = convert_strategies_to_arrays(model, qtable, y)
+    v1, v2 = evaluate_horizons(model.reward_tensor, model.transition_tensor, 
+        f_array, y_array)
+
+    for horizon, (values1, values2) in enumerate(zip(v1, v2)):
+        memfunc = MemoryFunctions(model, time_ahead = horizon)
+        value = objective_function(convert_strategies_to_list(qtable, y), 
+            memfunc)
+        print(f"Horizon {horizon}: objective {round(sum(values1 + values2), 6)}"
+            + f" from one pass, {round(value, 6)} from objective function")
+
+    results = sweep_horizons(Parameters(k = 3, m = 1, rates = [6, 24]), 
+        time_ahead = 3)
+    for horizon, result in enumerate(results):
+        print(f"Equilibrium for horizon {horizon}: y = {result['y']}, " + 
+              f"objective at each horizon {result['values'].round(4)}")
+
+def test_softmax_solver():
+
+    params = Parameters(k = 4)
+    values = {}
+
+    for method in ["slsqp", "softmax"]:
+        start = time.perf_counter()
+        model, f, y = optimize_game(params, method = method)
+        elapsed = time.perf_counter() - start
+
+        validate_transmit_strategy(model, f, precision = 3)
+        validate_jammer_strategy(model, y, precision = 3)
+        assert all(type(p) == float for p in y)
+        values[method] = objective_function(convert_strategies_to_list(f, y),
+            MemoryFunctions(model))
+        print(f"{method}: objective {round(values[method], 4)} in " + 
+              f"{round(elapsed, 2)} seconds")
+
+    assert values["softmax"] <= values["slsqp"] + 0.05 + 0.01 * abs(
+        values["slsqp"])
+
+def test_checkpoint():
+
+    params = Parameters(k = 4)
+    path = os.path.join(tempfile.mkdtemp(), "equilibrium.ckpt")
+
+    _, _, y = optimize_game(params, method = "softmax", 
+        checkpoint_path = path, checkpoint_interval = 0)
+    with open(path, "rb") as file:
+        checkpoint = pickle.load(file)
+    print(f"Checkpoint after {checkpoint['iterations']} iterations: " + 
+          f"best objective {round(checkpoint['best_value'], 4)}, " + 
+          f"complete {checkpoint['complete']}")
+
+    # The best value is the plain objective of the (projected) best iterate
+    model = Model(params)
+    _, best_y = convert_list_to_strategies(model, 
+        checkpoint["best_input"])
+    validate_jammer_strategy(model, best_y, precision = 6)
+    value = objective_function(checkpoint["best_input"], 
+        MemoryFunctions(model))
+    assert abs(value - checkpoint["best_value"]) < 1e-6
+
+    _, _, resumed_y = optimize_game(params, method = "softmax", 
+        checkpoint_path = path, resume = True)
+    print(f"Jammer strategy {y}, after resuming {resumed_y}")
+
+    try:
+        optimize_game(Parameters(k = 5), checkpoint_path = path, 
+            resume = True)
+    except ValueError as e:
+        print(f"Resuming with other parameters rejected: {e}")
+    else:
+        raise AssertionError("Resuming with other parameters was not rejected")
+
+    os.remove(path)
+
+def test_sweep_queue():
+
+    path = os.path.join(tempfile.mkdtemp(), "sweep.db")
+    queue = SweepQueue(path, lease_time = 0.1)
+    queue.enqueue([Parameters(k = k, m = 1, rates = [6, 24]) 
+        for k in range(3, 7)], method = "softmax", games = 20)
+
+    # A worker that claims a point and then disappears
+    point_id, _, _ = queue.claim("lost worker")
+    time.sleep(0.2)
+    print(f"Reclaimed {queue.reclaim_expired()} expired lease(s): " + 
+          f"{queue.get_status()}")
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, PYTHONPATH = directory)
+    workers = [subprocess.Popen([sys.executable, 
+        os.path.join(directory, "sweep.py"), "worker", path], cwd = directory,
+        env = environment, stdout = subprocess.PIPE, text = True) 
+        for _ in range(3)]
+    for worker in workers:
+        print(f"Worker: {worker.communicate()[0].strip()}")
+        assert worker.returncode == 0
+
+    late_result_accepted = queue.complete(point_id, "lost worker", {})
+    print(f"Late result from the lost worker accepted: " + 
+          f"{late_result_accepted}")
+    print(f"Queue status: {queue.get_status()}")
+    assert not late_result_accepted
+    assert queue.get_status() == {"done": 4}
+    for params, _, result in queue.get_results():
+        print(f"k = {params.k}: mean reward " + 
+              f"{round(result['rewards']['mean'], 4)}")
+
+    os.remove(path)
+
+    # A point whose lease keeps expiring fails after MAX_ATTEMPTS attempts
+    queue = SweepQueue(path, lease_time = 0.01)
+    queue.enqueue([Parameters(k = 3, m = 1, rates = [6, 24])])
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.claim("crashing worker") is not None
+        time.sleep(0.02)
+    print(f"Point with {MAX_ATTEMPTS} expired leases: " + 
+          f"{queue.claim('crashing worker')}, {queue.get_status()}")
+    assert queue.get_status() == {"failed": 1}
+
+    os.remove(path)
+
+def test_validate_strategies():
+
+    params = Parameters(k = 10)
+    model = Model(params)
+    rng = np.random.default_rng(0)
+
+    f = rng.dirichlet(np.ones(len(model.action_space)), 
+        size = (1000, len(model.state_space)))
+    y = project_jammer_strategy(rng.dirichlet(np.ones(params.m + 1), 
+        size = 1000), params.p_jam, params.p_avg)
+
+    start = time.perf_counter()
+    validate_transmit_strategies(model, f, precision = 6)
+    validate_jammer_strategies(model, y, precision = 6)
+    print(f"Validated 1000 pairs of strategies in " + 
+          f"{round((time.perf_counter() - start) * 1000, 3)} ms")
+
+    f[10, 2] *= 2
+    y[20] = np.eye(params.m + 1)[-1]
+    for validate, strategies in [(validate_transmit_strategies, f), 
+            (validate_jammer_strategies, y)]:
+        try:
+            validate(model, strategies, precision = 6)
+        except ValueError as e:
+            print(e)
+        else:
+            raise AssertionError(f"{validate.__name__} did not reject an " + 
+                "invalid strategy")
+
+def test_strategy_index():
+
+    path = os.path.join(tempfile.mkdtemp(), "index.npz")
+    base_params = Parameters(k = 3, m = 1, rates = [6, 24])
+    build_strategy_index(path, [3, 4], [0.6, 0.8, 1.0], [25, 50], [10, 25], 
+        base_params)
+
+    index = StrategyIndex(path)
+    _, y, error = index.query(3, 0.8, 50, 25)
+    print(f"Exact entry: y = {y}, error {error}")
+    assert error == 0
+
+    queries = 1000
+    start = time.perf_counter()
+    for _ in range(queries):
+        f, y, error = index.query(4, 0.7, 40, 20)
+    elapsed = (time.perf_counter() - start) / queries
+
+    model = Model(Parameters(k = 4, m = 1, rates = [6, 24], p_avg = 0.7, 
+        c = 40, l = 20))
+    validate_transmit_strategy(model, f, precision = 6)
+    validate_jammer_strategy(model, y, precision = 6)
+    print(f"Interpolated: y = {y}, error {round(error, 4)}, " + 
+          f"{round(elapsed * 1000, 4)} ms per query")
+    assert error < 0.1
+
+    os.remove(path)
+
+def test_jammer_tournament():
+
+    params = Parameters(k = 10)
+    model = Model(params)
+
+    qtable = QTable(model)
+    qtable.epsilon = 1
+    fs = [qtable, create_demo_transmit_strategy(model)]
+    y = create_demo_jammer_strategy(model)
+
+    start = time.perf_counter()
+    rewards, errors = run_tournament(fs, y, model, games = 500, 
+        processes = 2, seed = 0)
+    elapsed = time.perf_counter() - start
+
+    print(f"Tournament against {list(JAMMER_MODELS)} took " + 
+          f"{round(elapsed, 2)} seconds")
+    for i, (reward, error) in enumerate(zip(rewards, errors)):
+        print(f"Transmit strategy {i}: rewards {reward.round(3)}, " + 
+              f"standard errors {error.round(3)}")
+
+def test_lumped_model():
+
+    for params in [Parameters(k = 3), Parameters(k = 10), 
+            Parameters(k = 10, n = 3)]:
+        model = LumpedModel(params)
+        print(f"k = {params.k}, n = {params.n}: " + 
+              f"{len(model.full_model.state_space)} states, " + 
+              f"{len(model.blocks)} blocks {model.blocks}")
+
+        # Without any reduction, the tables are shared with the full model
+        if len(model.blocks) == len(model.full_model.state_space):
+            assert (model.transition_tensor 
+                is model.full_model.transition_tensor)
+            assert (model.transition_probabilities 
+                is model.full_model.transition_probabilities)
+
+        # Strategies on the lumped model should be worth the same on the 
+        # full model once expanded
+        f = create_demo_transmit_strategy(model)
+        y = create_demo_jammer_strategy(model)
+        full_f = model.expand_strategy(f)
+        lumped_value = evaluate_cost_grid(model, f, y, [params.c], 
+            [params.l])[0, 0]
+        full_value = evaluate_cost_grid(model.full_model, full_f, y, 
+            [params.c], [params.l])[0, 0]
+        print(f"Objective on the lumped model: {lumped_value:.6f}, " + 
+              f"on the full model: {full_value:.6f}")
+        assert abs(lumped_value - full_value) < 1e-9
+
+    model, f, y = optimize_game(Parameters(k = 10), method = "softmax", 
+        lump_states = True)
+    assert list(f) == model.state_space
+    print(f"Solved with lump_states: {len(f)} states in f, y = {y}")
+
+def test_transmitter_controller():
+
+    params = Parameters(k = 10)
+    model = Model(params)
+    f, _ = create_random_strategies(model)
+    controller = TransmitterController(f, model, seed = 0)
+
+    # The decisions do not repeat the draws of the PN sequence
+    assert (TransmitterController(f, model, seed = 0).random() 
+        != random.Random(0).random())
+
+    # The state follows the rules of Simulation.play_turn
+    decision = controller.decide(True)
+    expected = "j" if decision.hop else "1"
+    print(f"After an ACK: {decision}, state {controller.get_state()} " + 
+          f"(expected {expected})")
+    assert controller.get_state() == expected
+
+    controller.decide(False)
+    print(f"After a NACK: state {controller.get_state()} " + 
+          f"(expected j)")
+    assert controller.get_state() == "j"
+
+    # Action frequencies follow f in every state
+    counts = Counter()
+    for _ in range(20000):
+        counts[controller.decide(True).action] += 1
+    frequencies = [counts[action] / 20000 for action in model.action_space]
+    print(f"Action frequencies (expected {round(1 / len(frequencies), 4)}):" +
+          f" {np.round(frequencies, 4)}")
+
+    demo = TransmitterController(create_demo_transmit_strategy(model), model,
+        seed = 0)
+    actions = [demo.decide(True).action for _ in range(20)]
+    print(f"Demo strategy actions: {actions}")
+
+    rate = benchmark_controller(controller, decisions = 200000)
+    print(f"Controller makes {round(rate):,} decisions per second")
+
+def test_batch_equilibria():
+
+    base = Parameters(k = 4)
+    points = [Parameters(k = 4, p_avg = base.p_avg * scale) 
+        for scale in [0.5, 0.75, 1, 1.25]]
+
+    start = time.perf_counter()
+    results = find_equilibria(points)
+    elapsed = time.perf_counter() - start
+    print(f"Solved {len(points)} points in {round(elapsed, 2)} seconds")
+
+    for params, result in zip(points, results):
+        model = Model(params)
+        validate_transmit_strategy(model, result["f"], 3)
+        validate_jammer_strategy(model, result["y"], 3)
+        print(f"p_avg = {round(params.p_avg, 4)}: value " + 
+              f"{round(result['value'], 3)}, converged {result['converged']}" +
+              f" after {result['iterations']} iterations")
+
+    try:
+        find_equilibria([Parameters(k = 4), Parameters(k = 5)])
+    except ValueError as e:
+        print(f"Mismatched shapes rejected: {e}")
+    else:
+        raise AssertionError("Mismatched shapes were not rejected")
+
+def test_refine_sweep():
+
+    start = time.perf_counter()
+    result = refine_sweep({"p_avg": [0.2, 0.6, 1.0]}, Parameters(k = 4), 
+        budget = 12)
+    elapsed = time.perf_counter() - start
+
+    print(f"Solved {result['solves']} points in {round(elapsed, 2)} seconds")
+    for point in sorted(result["points"], key = lambda p: p["params"]["p_avg"]):
+        print(f"p_avg = {round(point['params']['p_avg'], 4)}: reward " + 
+              f"{round(point['reward'], 3)}, hop probability " + 
+              f"{round(point['hop_probability'], 3)}, mean rate index " + 
+              f"{round(point['mean_rate_index'], 2)}")
+    for cell in result["refinements"]:
+        print(f"Refined {cell['lower']} to {cell['upper']} (difference " + 
+              f"{round(cell['difference'], 3)}, depth {cell['depth']})")
+
+    finest = min([cell["upper"][0] - cell["lower"][0] 
+        for cell in result["cells"]])
+    print(f"A uniform grid at the finest spacing would need " + 
+          f"{round(0.8 / finest) + 1} points")
+
+    # The points of the coarse grid count towards the budget
+    try:
+        refine_sweep({"p_avg": [0.2, 0.6, 1.0]}, Parameters(k = 4), 
+            budget = 2)
+    except ValueError as e:
+        print(f"Coarse grid over budget rejected: {e}")
+    else:
+        raise AssertionError("Coarse grid over budget was not rejected")
+
 def main():
     test_create_parameters()
     test_validate_jammer_strategy()
@@ -170,6 +889,30 @@ def main():
     test_convert_parameters()
     test_convert_strategies()
     test_random_strategies()
+    test_control_variate()
+    test_importance_sampling()
+    test_lazy_model()
+    test_cost_grid()
+    test_headless_imports()
+    test_multilink_simulation()
+    test_multilink_matches_simulation()
+    test_shared_jammer()
+    test_evaluation_service()
+    test_shared_model()
+    test_large_k_simulation()
+    test_stream_simulation()
+    test_sensitivity()
+    test_sweep_horizons()
+    test_softmax_solver()
+    test_checkpoint()
+    test_sweep_queue()
+    test_validate_strategies()
+    test_strategy_index()
+    test_jammer_tournament()
+    test_lumped_model()
+    test_transmitter_controller()
+    test_batch_equilibria()
+    test_refine_sweep()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file